@@ -0,0 +1,188 @@
+# Copyright (C) 2011 by Matt Woodfield
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+# Renders the whole site to static files, using the same code and templates
+# as the request handlers in hypr.py:
+#
+#   python build.py [--full] [output_dir]
+#
+# A manifest in the output directory records each article's source hash and
+# mtime and the articles every output was rendered from. Later builds only
+# re-render the outputs affected by added, edited or removed articles. A
+# change to the templates or site settings, or --full, renders everything.
+#
+# The App Engine SDK and its bundled django and yaml libraries must be on
+# PYTHONPATH. The static handlers in app.yaml serve the output and fall
+# through to hypr.py for anything that has not been built.
+
+import os
+import sys
+import hashlib
+import config
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api.memcache import memcache_stub
+try:
+  import json
+except ImportError:
+  from django.utils import simplejson as json
+
+# hypr caches through memcache, so give it a local stub to talk to.
+apiproxy_stub_map.apiproxy = apiproxy_stub_map.APIProxyStubMap()
+apiproxy_stub_map.apiproxy.RegisterStub('memcache', memcache_stub.MemcacheServiceStub())
+
+import hypr
+
+# Templates in pages/ that are rendered with data rather than as plain pages.
+dynamic_pages = ['index', 'article', 'archives']
+
+manifest_name = '.manifest'
+
+def build(output_dir, full=False):
+  manifest = load_manifest(output_dir)
+  if full or manifest.get('settings') != settings_digest():
+    manifest = { 'settings' : settings_digest(), 'articles' : {}, 'outputs' : {} }
+    full     = True
+  articles, changed = scan(manifest['articles'])
+  current = outputs()
+  for name, (depends, render) in current.items():
+    if full or manifest['outputs'].get(name) != depends \
+        or changed.intersection(depends) \
+        or not os.path.exists(os.path.join(output_dir, name)):
+      write(output_dir, name, render())
+  for name in manifest['outputs']:
+    if name not in current:
+      remove(output_dir, name)
+  manifest['articles'] = articles
+  manifest['outputs']  = dict([(name, depends) for name, (depends, render) in current.items()])
+  save_manifest(output_dir, manifest)
+
+def scan(known):
+  # Returns the current {id: {hash, mtime}} and the ids whose source changed.
+  # Sources whose mtime is unchanged are not re-read.
+  articles = {}
+  changed  = set()
+  for entry in hypr.article_index.find():
+    filename = hypr.path(config.articles_dir+entry['id']+config.article_file_type)
+    mtime    = os.stat(filename).st_mtime
+    previous = known.get(entry['id'])
+    if previous is not None and previous['mtime'] == mtime:
+      articles[entry['id']] = previous
+      continue
+    digest = hashlib.md5(file(filename, 'rb').read()).hexdigest()
+    articles[entry['id']] = { 'hash' : digest, 'mtime' : mtime }
+    if previous is None or previous['hash'] != digest:
+      changed.add(entry['id'])
+  return articles, changed
+
+def outputs():
+  # Maps every output file to the ids of the articles it shows and a
+  # function that renders it.
+  outputs = {}
+  front   = ids(hypr.Archives().all("", config.articles_per_page))
+  outputs['index.html']  = (front, hypr.render_index)
+  outputs['rss.xml']     = (front, lambda: hypr.render_feed('rss'))
+  outputs['sitemap.xml'] = (front, lambda: hypr.render_feed('sitemap'))
+  buckets = set([''])
+  for entry in hypr.article_index.find():
+    render = lambda article_id=entry['id']: hypr.render_article(hypr.Article(article_id))
+    outputs[entry['url'].lstrip('/')+'/index.html'] = ([entry['id']], render)
+    year, month, day = entry['date'].split('-')
+    buckets.update([year, year+'-'+month, entry['date']])
+  for bucket in buckets:
+    render = lambda bucket=bucket: hypr.render_archives(*archive_args(bucket))
+    outputs[archive_path(bucket)] = (ids(hypr.Archives().all(bucket)), render)
+  for page in pages():
+    outputs[page+'/index.html'] = ([], lambda page=page: hypr.render_page(page))
+  return outputs
+
+def ids(archives):
+  return [archive['id'] for archive in archives]
+
+def settings_digest():
+  # Everything besides the articles that ends up in the output.
+  digest = hashlib.md5(hypr.markdown_settings())
+  for name in ['site_name', 'site_description', 'site_keywords', 'site_url', 'articles_per_page']:
+    digest.update(repr(getattr(config, name)))
+  for root, dirs, files in os.walk(hypr.path(config.templates_dir)):
+    dirs.sort()
+    for name in sorted(files):
+      digest.update(name)
+      digest.update(file(os.path.join(root, name), 'rb').read())
+  return digest.hexdigest()
+
+def load_manifest(output_dir):
+  try:
+    return json.load(file(os.path.join(output_dir, manifest_name), 'rb'))
+  except (IOError, ValueError):
+    return {}
+
+def save_manifest(output_dir, manifest):
+  write(output_dir, manifest_name, json.dumps(manifest))
+
+def archive_args(bucket):
+  args = []
+  if bucket:
+    args = bucket.split('-')
+  return args+[None]*(3-len(args))
+
+def archive_path(bucket):
+  if bucket:
+    return 'archives/'+bucket.replace('-', '/')+'/index.html'
+  return 'archives/index.html'
+
+def pages():
+  pages = []
+  for name in os.listdir(hypr.path(config.templates_dir+'pages')):
+    page, ext = os.path.splitext(name)
+    if ext == '.html' and page not in dynamic_pages:
+      pages.append(page)
+  return pages
+
+def write(output_dir, name, content):
+  filename = os.path.join(output_dir, name.lstrip('/'))
+  if not os.path.isdir(os.path.dirname(filename)):
+    os.makedirs(os.path.dirname(filename))
+  if isinstance(content, unicode):
+    content = content.encode('utf-8')
+  out = file(filename, 'wb')
+  out.write(content)
+  out.close()
+
+def remove(output_dir, name):
+  filename = os.path.join(output_dir, name)
+  if os.path.exists(filename):
+    os.remove(filename)
+    try:
+      os.removedirs(os.path.dirname(filename))
+    except OSError:
+      pass # not empty
+
+def main():
+  args = sys.argv[1:]
+  full = '--full' in args
+  args = [arg for arg in args if arg != '--full']
+  if args:
+    output_dir = args[0]
+  else:
+    output_dir = hypr.path(config.build_dir)
+  build(output_dir, full)
+
+if __name__ == '__main__':
+  main()
@@ -3,7 +3,12 @@ site_description    = 'This is my blog'
 site_keywords       = 'keyword1, keyword2, keyword3'
 site_url            = 'http://localhost:8082/'
 cache_time          = 1
+response_cache_time = 60*60 # seconds a rendered page is cached, 0 to disable
+gzip_responses      = False # App Engine compresses responses itself
 article_file_type   = '.md' # '.md' or '.txt'
 articles_per_page   = 10
 templates_dir       = 'site/templates/'
-articles_dir        = 'site/articles/'
\ No newline at end of file
+articles_dir        = 'site/articles/'
+build_dir           = 'build/' # output of build.py
+markdown_extensions = []
+markdown_safe_mode  = False
\ No newline at end of file
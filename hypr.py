@@ -21,8 +21,13 @@
 import os
 import re
 import cgi
+import time
 import yaml
+import zlib
+import bisect
+import hashlib
 import markdown
+import email.utils
 import config
 from google.appengine.ext import webapp
 from google.appengine.api import memcache
@@ -31,124 +36,523 @@ from google.appengine.ext.webapp import template
 from django.template import TemplateDoesNotExist
 
 class Article:
-  def __init__(self, article_id):
+  def __init__(self, article_id, deferred=False, source=None):
+    # A deferred article only loads its source; call prepare() before
+    # rendering it. The source is loaded here unless it is passed in.
     self.id       = re.sub('.md', '', article_id)
     self.id       = re.sub('.txt', '', article_id)
-    self.raw      = self.load()
+    self.raw      = source
+    if self.raw is None:
+      self.raw    = self.load()
     if self.raw is not None:
-      self.raw      = self.raw.split("\n\n", 1)
-      self.url      = config.site_url+re.sub('-', '/', self.id, 3)
-      self.meta     = yaml.load(self.raw[0])
-      self.summary  = markdown.markdown(self.raw[1].split('<!-- ~ -->', 1)[0])
-      self.body     = markdown.markdown(self.raw[1])
+      self.digest   = hashlib.md5(markdown_settings()+self.raw).hexdigest()
+      if not deferred:
+        self.prepare()
+
+  def prepare(self, compiled=None):
+    if compiled is None:
+      compiled    = self.compile()
+    self.raw      = self.raw.split("\n\n", 1)
+    self.url      = config.site_url+re.sub('-', '/', self.id, 3)
+    self.meta     = compiled['meta']
+    self.summary  = compiled['summary']
+    self.body     = compiled['body']
+
+  def modified(self):
+    try:
+      return os.stat(path(config.articles_dir+self.id+config.article_file_type)).st_mtime
+    except OSError: return
     
   def load(self):
-    article = memcache.get(self.id, 'article_')
+    key = article_key(self.id, *generations.get('site', 'article:'+self.id))
+    article = memcache.get(key, 'article_')
     if article is None:
-      try:
-        static_article_path = path(config.articles_dir+self.id+config.article_file_type)
-        article = file(static_article_path, 'rb').read()
-        memcache.set(self.id, article, config.cache_time, 0, 'article_')
-      except IOError: return
+      article = read_article(self.id)
+      if article is not None:
+        memcache.set(key, article, config.cache_time, 0, 'article_')
     return article
 
+  def compile(self):
+    # Compiled output is keyed by the source and the markdown settings, so
+    # an entry can never go stale and is cached without expiry.
+    key = self.digest
+    compiled = memcache.get(key, 'compiled_')
+    if compiled is None:
+      compiled = self.convert()
+      memcache.set(key, compiled, 0, 0, 'compiled_')
+    return compiled
+
+  def convert(self):
+    head, text = self.raw.split("\n\n", 1)
+    summary, body = render(text)
+    return {
+      'meta'    : yaml.load(head),
+      'summary' : summary,
+      'body'    : body
+    }
+
+def article_key(article_id, site, generation):
+  return '%d:%d:%s' % (site, generation, article_id)
+
+def read_article(article_id):
+  try:
+    return file(path(config.articles_dir+article_id+config.article_file_type), 'rb').read()
+  except IOError: return
+
 class Articles:
   def all(self):
     archives = Archives().all("", config.articles_per_page)
+    return self.load([archive['name'] for archive in archives])
+
+  def load(self, article_ids):
+    # Loads a listing with one memcache round trip per namespace rather
+    # than several per article, and caches whatever was missing in one go.
+    found    = generations.get('site', *['article:'+article_id for article_id in article_ids])
+    keys     = [article_key(article_id, found[0], generation)
+                for article_id, generation in zip(article_ids, found[1:])]
+    sources  = memcache.get_multi(keys, namespace='article_')
+    missing  = {}
     articles = []
-    for archive in archives:      
-      article = Article(archive['name'])
-      if article.raw is not None:
-        articles.append(article)
+    for key, article_id in zip(keys, article_ids):
+      source = sources.get(key)
+      if source is None:
+        source = read_article(article_id)
+        if source is None:
+          continue
+        missing[key] = source
+      articles.append(Article(article_id, deferred=True, source=source))
+    if missing:
+      memcache.set_multi(missing, config.cache_time, namespace='article_')
+
+    compiled = memcache.get_multi([article.digest for article in articles], namespace='compiled_')
+    missing  = {}
+    for article in articles:
+      if article.digest not in compiled:
+        compiled[article.digest] = missing[article.digest] = article.convert()
+      article.prepare(compiled[article.digest])
+    if missing:
+      memcache.set_multi(missing, 0, namespace='compiled_')
     return articles
 
 class Archives:
   def all(self, filter="", limit=25, offset=0):
-    index_from  = (limit*offset) 
-    index_to    = ((limit*offset)+limit)
-    archives = memcache.get('archives_'+filter+"_"+str(index_from)+"_"+str(index_to))
-    if archives == None:
-      archives    = []
-      article_dir = path(config.articles_dir)
-      for root, dirs, files in os.walk(article_dir):
-        count = 0
+    return article_index.find(filter, limit, limit*offset)
+
+class ArticleIndex:
+  # Sorted index of every article, shared by all requests served by this
+  # process. It is rebuilt whenever the articles directory changes. Only
+  # the directory is checked: articles change with a deployment, which
+  # changes site_version() as well.
+  def __init__(self, article_dir):
+    self.article_dir = article_dir
+    self.mtime       = None
+    self.ids         = []
+    self.entries     = {}
+    self.modified    = None
+
+  def refresh(self):
+    # Called once per request by Handler; the lookups below use the index
+    # as it was then.
+    mtime = os.stat(self.article_dir).st_mtime
+    if mtime != self.mtime:
+      entries  = {}
+      modified = mtime
+      for root, dirs, files in os.walk(self.article_dir):
         for name in files:
-          if filter in name and name.index('.') > 0:
-            if count >= index_from and count < index_to:
-              name    = re.sub('.md', '', name)
-              name    = re.sub('.txt', '', name)
-              url     = '/'+re.sub('-', '/', name, 3)
-              archive = {
-                'name' : name,
-                'url'  : url
-              }
-              archives.append(archive)
-            count += 1
-      archives = sorted(archives, key=lambda archive:archive['name'])[::-1]
-      memcache.set('archives_'+filter+"_"+str(index_from)+"_"+str(index_to), archives, config.cache_time)
-    return archives
-
-class Index(webapp.RequestHandler):
+          if name.endswith(config.article_file_type):
+            article_id = name[:-len(config.article_file_type)]
+            filename   = os.path.join(root, name)
+            entries[article_id] = self.entry(article_id, filename)
+            modified   = max(modified, os.stat(filename).st_mtime)
+      self.ids      = sorted(entries)
+      self.entries  = entries
+      self.mtime    = mtime
+      self.modified = modified
+
+  def entry(self, article_id, filename):
+    return IndexEntry(filename,
+      id   = article_id,
+      name = article_id,
+      date = article_id[:10],
+      slug = article_id[11:],
+      url  = '/'+re.sub('-', '/', article_id, 3)
+    )
+
+  def find(self, prefix="", limit=None, offset=0):
+    # Ids start with their date, so a date prefix selects a contiguous range.
+    if self.mtime is None:
+      self.refresh()
+    start = bisect.bisect_left(self.ids, prefix)
+    end   = bisect.bisect_left(self.ids, prefix+'\xff')
+    ids   = self.ids[start:end][::-1]
+    if limit is not None:
+      ids = ids[offset:offset+limit]
+    else:
+      ids = ids[offset:]
+    return [self.entries[article_id] for article_id in ids]
+
+  def version(self):
+    # The latest change to the articles directory or any article in it,
+    # which stands for the state of every listing.
+    if self.mtime is None:
+      self.refresh()
+    return self.modified
+
+class IndexEntry(dict):
+  # An entry of the article index. Its 'tags' are read from the article's
+  # header the first time they are asked for, so building the index does
+  # not parse every article.
+  def __init__(self, filename, **fields):
+    dict.__init__(self, fields)
+    self.filename = filename
+
+  def __missing__(self, key):
+    if key != 'tags':
+      raise KeyError(key)
+    self['tags'] = read_tags(self.filename)
+    return self['tags']
+
+  def get(self, key, default=None):
+    try:
+      return self[key]
+    except KeyError: return default
+
+def read_tags(filename):
+  # Only the YAML header is read; it ends at the first blank line.
+  header = []
+  for line in file(filename, 'rb'):
+    if not line.strip(): break
+    header.append(line)
+  try:
+    meta = yaml.load(''.join(header))
+  except yaml.YAMLError: return []
+  if not isinstance(meta, dict) or not meta.get('tags'): return []
+  tags = meta['tags']
+  if isinstance(tags, basestring):
+    tags = tags.split(',')
+  return [str(tag).strip() for tag in tags]
+
+class Generations:
+  # Generation numbers that are part of cache keys: 'site' for everything,
+  # 'listings' for the index, feeds and archives, and 'article:<id>' for
+  # each article. Bumping one leaves the entries keyed with the old number
+  # unused until they expire, so a flush only costs the reads and renders
+  # that depend on it.
+  def get(self, *names):
+    found   = memcache.get_multi(names, namespace='generation_')
+    missing = [name for name in names if name not in found]
+    if missing:
+      # Start from the clock, so a counter evicted from memcache does not
+      # come back with a number that was used before.
+      start = int(time.time())
+      memcache.add_multi(dict([(name, start) for name in missing]), namespace='generation_')
+      found.update(memcache.get_multi(missing, namespace='generation_'))
+    return [found.get(name, 0) for name in names]
+
+  def bump(self, *names):
+    for name in names:
+      memcache.incr(name, 1, 'generation_', int(time.time()))
+
+class ResponseCache:
+  # Rendered responses, keyed by route, the generations the route depends
+  # on and the content version, so a flush or a change to the articles,
+  # the markdown settings or the deployment leaves every old entry unused
+  # until it expires. Entries are kept in memcache and in this process.
+  def __init__(self, size=100):
+    self.size  = size
+    self.local = {}
+
+  def key(self, route):
+    if route.startswith('article/'):
+      names = ['site', 'article:'+route[len('article/'):]]
+    elif route.startswith('page/'):
+      names = ['site']
+    else:
+      names = ['site', 'listings']
+    return hashlib.md5(content_version()+route+repr(generations.get(*names))).hexdigest()
+
+  def get(self, route):
+    # Returns the key for the route along with the cached response, so a
+    # response rendered after a miss is stored without working it out again.
+    if not config.response_cache_time:
+      return None, None
+    key = self.key(route)
+    entry = self.local.get(key)
+    if entry is not None and entry[0] > time.time():
+      return key, entry[1]
+    response = memcache.get(key, 'response_')
+    if response is not None:
+      self.remember(key, response)
+    return key, response
+
+  def set(self, key, response):
+    if key is None:
+      return
+    memcache.set(key, response, config.response_cache_time, 0, 'response_')
+    self.remember(key, response)
+
+  def remember(self, key, response):
+    if len(self.local) >= self.size:
+      self.local.clear()
+    self.local[key] = (time.time()+config.response_cache_time, response)
+
+class Handler(webapp.RequestHandler):
+  def initialize(self, request, response):
+    webapp.RequestHandler.initialize(self, request, response)
+    # Checked for new articles once, however often the request uses it.
+    article_index.refresh()
+
+class Index(Handler):
   def get(self):
-    articles = Articles().all()
-    template_vars = { 'articles' : articles }
-    self.response.out.write(template.render(path(config.templates_dir+'pages/index.html'), template_vars))
+    if send_cached(self, 'index'):
+      return
+    etag, modified = listing_validators('index')
+    if not_modified(self, etag, modified):
+      return
+    respond(self, render_index(), etag, modified)
 
-class ViewArticle(webapp.RequestHandler):
+class ViewArticle(Handler):
   def get(self, year, month, day, title):
     article_id    = cgi.escape(year)+'-'+cgi.escape(month)+'-'+cgi.escape(day)+'-'+cgi.escape(title)
-    article       = Article(article_id)
+    # Checked before any cache lookup, as that keeps a generation counter
+    # for the article and any url would otherwise get one.
+    if article_id not in article_index.entries:
+      send_page(self, '404')
+      return
+    if send_cached(self, 'article/'+article_id):
+      return
+    article       = Article(article_id, deferred=True)
     if article.raw is not None:
-      template_vars = { 'article' : article }
-      self.response.out.write(template.render(path(config.templates_dir+'pages/article.html'), template_vars))
+      etag, modified = validator('article', article.digest), article.modified()
+      if not_modified(self, etag, modified):
+        return
+      article.prepare()
+      respond(self, render_article(article), etag, modified)
     else:
-      self.response.out.write(template.render(path(config.templates_dir+'pages/404.html'), {}))
+      send_page(self, '404')
 
-class ViewArchives(webapp.RequestHandler):
+class ViewArchives(Handler):
   def get(self, year=None, month=None, day=None):
-    if year == None:
-      archives = Archives().all()
-    else:
-      filter = cgi.escape(year)
-      if month is not None: 
-        filter += '-'+cgi.escape(month)
-        if day is not None: 
-          filter += '-'+cgi.escape(day)
-      archives = Archives().all(filter)
-    template_vars = {
-      'year'      : year,
-      'month'     : month,
-      'day'       : day,
-      'archives'  : archives
-    }
-    self.response.out.write(template.render(path(config.templates_dir+'pages/archives.html'), template_vars))
+    if year is not None:
+      year = cgi.escape(year)
+    if month is not None:
+      month = cgi.escape(month)
+    if day is not None:
+      day = cgi.escape(day)
+    route = 'archives/%s/%s/%s' % (year, month, day)
+    if send_cached(self, route):
+      return
+    respond(self, render_archives(year, month, day))
 
-class PageHandler(webapp.RequestHandler):
+class PageHandler(Handler):
   def get(self, page):
     page = cgi.escape(page.replace('/', ''))
     if page == "rss" or page == "sitemap":
-      file_type     = ('.xml','.feed')[page == 'rss']
-      template_vars = { 
-        'title'       : config.site_name,
-        'description' : config.site_description,
-        'site_url'    : config.site_url,
-        'articles'    : Articles().all() 
-      }
-      self.response.out.write(template.render(path(config.templates_dir+page+file_type), template_vars))
+      if send_cached(self, page):
+        return
+      etag, modified = listing_validators(page)
+      if not_modified(self, etag, modified):
+        return
+      respond(self, render_feed(page), etag, modified)
     else:
       try:
-        self.response.out.write(template.render(path(config.templates_dir+'pages/'+page+'.html'), {}))
+        send_page(self, page)
       except TemplateDoesNotExist:
-        self.response.out.write(template.render(path(config.templates_dir+'pages/404.html'), {}))
+        send_page(self, '404')
+
+def send_page(handler, page):
+  # Unknown pages are never cached, so they cannot fill the cache.
+  if not send_cached(handler, 'page/'+page):
+    respond(handler, render_page(page))
+
+# Output cache. A cached response holds the body as sent, a gzipped copy
+# of it when gzip_responses is set, its headers and its validators, and is
+# served without rendering anything.
+
+def send_cached(handler, route):
+  # Keeps the key looked up for the route, for respond() to store under.
+  handler.cache_key, response = response_cache.get(route)
+  if response is None:
+    return False
+  send(handler, response)
+  return True
+
+def respond(handler, body, etag=None, modified=None):
+  # Called after send_cached() missed, and caches what it sends.
+  if isinstance(body, unicode):
+    body = body.encode('utf-8')
+  response = {
+    'body'     : body,
+    'gzip'     : None,
+    'headers'  : [(name, value) for name, value in handler.response.headers.items()
+                  if name.lower() not in ('etag', 'last-modified')],
+    'etag'     : etag,
+    'modified' : modified
+  }
+  if config.gzip_responses:
+    # Compressed once here rather than on every request that accepts it.
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16+zlib.MAX_WBITS)
+    response['gzip'] = compressor.compress(body)+compressor.flush()
+  response_cache.set(handler.cache_key, response)
+  send(handler, response)
+
+def send(handler, response):
+  for name, value in response['headers']:
+    handler.response.headers[name] = value
+  if response['etag'] is not None and \
+      not_modified(handler, response['etag'], response['modified']):
+    return
+  if response.get('gzip') is not None and accepts_gzip(handler):
+    handler.response.headers['Content-Encoding'] = 'gzip'
+    handler.response.out.write(response['gzip'])
+  else:
+    handler.response.out.write(response['body'])
+
+def accepts_gzip(handler):
+  # Sets Vary, as whether gzip is used depends on Accept-Encoding.
+  if not config.gzip_responses:
+    return False
+  handler.response.headers['Vary'] = 'Accept-Encoding'
+  for coding in handler.request.headers.get('Accept-Encoding', '').split(','):
+    params = [param.strip() for param in coding.split(';')]
+    if params[0].lower() in ('gzip', 'x-gzip'):
+      for param in params[1:]:
+        if param.startswith('q='):
+          try:
+            return float(param[2:]) > 0
+          except ValueError: return False
+      return True
+  return False
+
+# Conditional GET. Each response carries an ETag, and a Last-Modified date
+# where one is known, so clients can revalidate their copy and be answered
+# with a 304 before any markdown or template work is done.
+
+def validator(*parts):
+  return '"%s"' % hashlib.md5(site_version()+repr(parts)).hexdigest()
+
+def listing_validators(name):
+  modified = article_index.version()
+  return validator(name, repr(modified)), modified
+
+def not_modified(handler, etag, modified=None):
+  if accepts_gzip(handler):
+    # The gzipped variant needs a validator of its own.
+    etag = etag[:-1]+'-gzip"'
+  handler.response.headers['ETag'] = etag
+  if modified is not None:
+    handler.response.headers['Last-Modified'] = email.utils.formatdate(modified, usegmt=True)
+  if_none_match     = handler.request.headers.get('If-None-Match')
+  if_modified_since = handler.request.headers.get('If-Modified-Since')
+  if if_none_match is not None:
+    # If-Modified-Since is ignored when both are sent.
+    tags  = [tag.strip() for tag in if_none_match.split(',')]
+    fresh = '*' in tags or etag in tags or 'W/'+etag in tags
+  elif if_modified_since is not None and modified is not None:
+    since = email.utils.parsedate_tz(if_modified_since)
+    fresh = since is not None and int(modified) <= email.utils.mktime_tz(since)
+  else:
+    fresh = False
+  if fresh:
+    handler.response.set_status(304)
+  return fresh
+
+# Page rendering is shared by the request handlers above and by build.py,
+# which renders the whole site to static files.
+
+def render_index():
+  template_vars = { 'articles' : Articles().all() }
+  return template.render(path(config.templates_dir+'pages/index.html'), template_vars)
+
+def render_article(article):
+  template_vars = { 'article' : article }
+  return template.render(path(config.templates_dir+'pages/article.html'), template_vars)
+
+def render_archives(year=None, month=None, day=None):
+  if year == None:
+    archives = Archives().all()
+  else:
+    filter = year
+    if month is not None: 
+      filter += '-'+month
+      if day is not None: 
+        filter += '-'+day
+    archives = Archives().all(filter)
+  template_vars = {
+    'year'      : year,
+    'month'     : month,
+    'day'       : day,
+    'archives'  : archives
+  }
+  return template.render(path(config.templates_dir+'pages/archives.html'), template_vars)
+
+def render_feed(page):
+  file_type     = ('.xml','.feed')[page == 'rss']
+  template_vars = { 
+    'title'       : config.site_name,
+    'description' : config.site_description,
+    'site_url'    : config.site_url,
+    'articles'    : Articles().all() 
+  }
+  return template.render(path(config.templates_dir+page+file_type), template_vars)
+
+def render_page(page):
+  return template.render(path(config.templates_dir+'pages/'+page+'.html'), {})
 
 def path(path):
   return os.path.join(os.path.dirname(__file__), path)
 
+article_index  = ArticleIndex(path(config.articles_dir))
+generations    = Generations()
+response_cache = ResponseCache()
+
+def render(text):
+  # One conversion yields both the body and the summary (everything before
+  # the '<!-- ~ -->' marker); without a marker the summary is the body.
+  md      = markdown.markdownPool.acquire(markdown_extensions(), config.markdown_safe_mode)
+  body    = md.convert(text)
+  summary = md.Summary
+  if summary is None and summary_marker in text:
+    # The extension only splits on a marker that is a block of its own,
+    # so split the text as before for a marker with text around it.
+    md.reset()
+    summary = md.convert(text.split(summary_marker, 1)[0])
+  markdown.markdownPool.release(md)
+  if summary is None:
+    return body, body
+  return summary, body
+
+summary_marker = '<!-- ~ -->'
+
+# Part of the markdown settings. Bump it whenever render() changes its
+# output, so compiled articles cached by older code are not used.
+render_version = 2
+
+def markdown_extensions():
+  return ['summary']+config.markdown_extensions
+
+def markdown_settings():
+  return repr((markdown.version, markdown_extensions(), config.markdown_safe_mode, render_version))
+
+def site_version():
+  # Changes with the markdown settings and with every deployment, which
+  # may change the templates.
+  return os.environ.get('CURRENT_VERSION_ID', '')+markdown_settings()
+
+def content_version():
+  return site_version()+repr(article_index.version())
+
 class Admin(webapp.RequestHandler):
   def get(self, action):
     if action == "flush":
+      # /admin/flush?article=<id> flushes one article and the listings that
+      # show it; /admin/flush flushes the whole site.
       self.response.out.write('Flushing...')
-      memcache.flush_all()
+      article_id = self.request.get('article')
+      if article_id:
+        generations.bump('article:'+article_id, 'listings')
+      else:
+        generations.bump('site')
       self.redirect('/')
     else:
       self.error(404)
@@ -43,6 +43,8 @@ version = "2.0"
 version_info = (2,0,0, "Final")
 
 import re
+import os
+import time
 import codecs
 import sys
 import warnings
@@ -118,6 +120,37 @@ def isBlockLevel(tag):
     """Check if the tag is a block level HTML tag."""
     return BLOCK_LEVEL_ELEMENTS.match(tag)
 
+
+BLANK_LINES_RE = re.compile(r'\n\s+\n')
+BLANK_CHARS = " \t\f\v"  # What \s matches on a single line
+
+def normalizeSource(source):
+    """
+    Return the lines of a source text, ready for the preprocessors.
+
+    Placeholder characters are removed, line endings are made "\n", runs
+    of blank lines are collapsed to one empty line and tabs are expanded.
+    The text ends with one blank line followed by an empty one.  Steps
+    with nothing to do are skipped, so the source is copied as few times
+    as possible.
+
+    """
+    if STX in source:
+        source = source.replace(STX, "")
+    if ETX in source:
+        source = source.replace(ETX, "")
+    if "\r" in source:
+        source = source.replace("\r\n", "\n").replace("\r", "\n")
+    source = BLANK_LINES_RE.sub("\n\n", source)
+    if "\t" in source:
+        source = source.expandtabs(TAB_LENGTH)
+    lines = source.split("\n")
+    # Trailing blank lines collapse into the blank line that ends the text.
+    while len(lines) > 1 and not lines[-1].strip(BLANK_CHARS):
+        lines.pop()
+    lines.extend(["", ""])
+    return lines
+
 """
 MISC AUXILIARY CLASSES
 =============================================================================
@@ -174,6 +207,13 @@ etree = etree_loader.importETree()
 
 # Adds the ability to output html4
 import html4
+import serializers
+
+# Reusable instances for markdown() and long-running callers
+from pool import MarkdownPool
+
+# Opt-in timing of the processors
+from stats import MarkdownStats
 
 
 class Markdown:
@@ -210,6 +250,8 @@ class Markdown:
         self.registeredExtensions = []
         self.docType = ""
         self.stripTopLevelTags = True
+        self.stats = None
+        self.statsPatches = []
 
         # Preprocessors
         self.preprocessors = odict.OrderedDict()
@@ -306,6 +348,15 @@ class Markdown:
             'xhtml1': etree.tostring,
         }
 
+        # Map format keys to serializers that render the content of the
+        # root straight to unicode, without its wrapping tags
+        self.fragment_formats = {
+            'html'  : serializers.to_html_fragment,
+            'html4' : serializers.to_html_fragment,
+            'xhtml' : serializers.to_xhtml_fragment,
+            'xhtml1': serializers.to_xhtml_fragment,
+        }
+
         self.references = {}
         self.htmlStash = preprocessors.HtmlStash()
         self.registerExtensions(extensions = extensions,
@@ -348,10 +399,36 @@ class Markdown:
         for extension in self.registeredExtensions:
             extension.reset()
 
+    def enableStats(self, stats=None):
+        """
+        Record the calls and timings of every processor in a MarkdownStats
+        object, which is returned.  Pass one in to share it between
+        instances; otherwise a new one is made.  Statistics are gathered
+        until disableStats() is called.
+
+        Only the processors registered at the time are recorded, so call
+        this again after registering more.
+
+        """
+        self.disableStats()
+        if stats is None:
+            stats = MarkdownStats()
+        self.stats = stats
+        self.statsPatches = stats.instrument(self)
+        return stats
+
+    def disableStats(self):
+        """ Stop recording statistics. """
+        if self.stats is not None:
+            self.stats.restore(self.statsPatches)
+        self.stats = None
+        self.statsPatches = []
+
     def set_output_format(self, format):
         """ Set the output format for the class instance. """
         try:
             self.serializer = self.output_formats[format.lower()]
+            self.fragmentSerializer = self.fragment_formats.get(format.lower())
         except KeyError:
             message(CRITICAL, 'Invalid Output Format: "%s". Use one of %s.' \
                                % (format, self.output_formats.keys()))
@@ -364,42 +441,127 @@ class Markdown:
 
         * source: Source text as a Unicode string.
 
+        """
+        root = self.buildTree(source)
+        if root is None:
+            return u""  # a blank unicode string
+        return self.serializeTree(root)
+
+    def convertIter(self, source):
+        """
+        Convert markdown to serialized XHTML or HTML, one piece at a time.
+
+        The whole document is parsed first, as references and footnotes may
+        be defined anywhere in it.  Each top-level element is then
+        serialized and postprocessed on its own and yielded as soon as it is
+        ready, so the full output is never held in memory at once.  Joined
+        together, the pieces are identical to the output of ``convert``.
+
+        If the top-level tags are not being stripped, or any postprocessor
+        does not support ``streaming``, the output is yielded in one piece.
+
+        Keyword arguments:
+
+        * source: Source text as a Unicode string.
+
+        """
+        root = self.buildTree(source)
+        if root is None:
+            return
+        if not self.stripTopLevelTags or not len(root) or \
+                [pp for pp in self.postprocessors.values()
+                 if not getattr(pp, 'streaming', False)]:
+            yield self.serializeTree(root)
+            return
+
+        # Strip leading and trailing whitespace from the output as a whole,
+        # holding back whitespace until we know more output follows it.
+        started = False
+        pending = u""
+        for chunk in self.serializeChildren(root):
+            for pp in self.postprocessors.values():
+                chunk = pp.run(chunk)
+            if not started:
+                chunk = chunk.lstrip()
+                if not chunk:
+                    continue
+                started = True
+            body = chunk.rstrip()
+            if body:
+                yield pending + body
+                pending = chunk[len(body):]
+            else:
+                pending += chunk
+
+    def buildTree(self, source):
+        """
+        Run the preprocessors, parser and treeprocessors over the source and
+        return the root of the resulting ElementTree, or None if the source
+        is blank.
+
+        Keyword arguments:
+
+        * source: Source text as a Unicode string.
+
         """
 
         # Fixup the source text
         if not source.strip():
-            return u""  # a blank unicode string
+            return None
         try:
             source = unicode(source)
         except UnicodeDecodeError:
             message(CRITICAL, 'UnicodeDecodeError: Markdown only accepts unicode or ascii input.')
-            return u""
-
-        source = source.replace(STX, "").replace(ETX, "")
-        source = source.replace("\r\n", "\n").replace("\r", "\n") + "\n\n"
-        source = re.sub(r'\n\s+\n', '\n\n', source)
-        source = source.expandtabs(TAB_LENGTH)
+            return None
 
         # Split into lines and run the line preprocessors.
-        self.lines = source.split("\n")
+        self.lines = normalizeSource(source)
         for prep in self.preprocessors.values():
             self.lines = prep.run(self.lines)
 
         # Parse the high-level elements.
         root = self.parser.parseDocument(self.lines).getroot()
 
-        # Run the tree-processors
+        # Run the tree-processors.  Adjacent visiting tree-processors share
+        # a single walk over the tree.
+        visitors = []
         for treeprocessor in self.treeprocessors.values():
+            if isinstance(treeprocessor, treeprocessors.VisitingTreeprocessor):
+                visitors.append(treeprocessor)
+                continue
+            if visitors:
+                treeprocessors.walkTree(root, visitors)
+                visitors = []
             newRoot = treeprocessor.run(root)
             if newRoot:
                 root = newRoot
+        if visitors:
+            treeprocessors.walkTree(root, visitors)
+
+        return root
+
+    def serializeTree(self, root):
+        """
+        Serialize an ElementTree root and run the postprocessors.
+
+        This is the final stage of ``convert``.  It is public so extensions
+        can render part of a document (such as a summary) exactly the way
+        the whole document is rendered.
+
+        Keyword arguments:
+
+        * root: An ElementTree Element wrapping the content (a ``DOC_TAG``).
 
+        """
         # Serialize _properly_.  Strip top-level tags.
-        output, length = codecs.utf_8_decode(self.serializer(root, encoding="utf8"))
-        if self.stripTopLevelTags:
-            start = output.index('<%s>'%DOC_TAG)+len(DOC_TAG)+2
-            end = output.rindex('</%s>'%DOC_TAG)
-            output = output[start:end].strip()
+        if self.stripTopLevelTags and self.fragmentSerializer:
+            output = self.fragmentSerializer(root).strip()
+        else:
+            output, length = codecs.utf_8_decode(self.serializer(root, encoding="utf8"))
+            if self.stripTopLevelTags:
+                start = output.index('<%s>'%DOC_TAG)+len(DOC_TAG)+2
+                end = output.rindex('</%s>'%DOC_TAG)
+                output = output[start:end].strip()
 
         # Run the text post-processors
         for pp in self.postprocessors.values():
@@ -407,6 +569,26 @@ class Markdown:
 
         return output.strip()
 
+    def serializeChildren(self, root):
+        """
+        Serialize the top-level elements of an ElementTree root one at a
+        time, without the root's tags, and yield the serialized text of each.
+
+        """
+        text = root.text
+        for child in root:
+            wrapper = etree.Element(DOC_TAG)
+            wrapper.text = text
+            wrapper.append(child)
+            if self.fragmentSerializer:
+                yield self.fragmentSerializer(wrapper)
+            else:
+                output, length = codecs.utf_8_decode(self.serializer(wrapper, encoding="utf8"))
+                start = output.index('<%s>'%DOC_TAG)+len(DOC_TAG)+2
+                end = output.rindex('</%s>'%DOC_TAG)
+                yield output[start:end]
+            text = None
+
     def convertFile(self, input=None, output=None, encoding=None):
         """Converts a markdown file and returns the HTML as a unicode string.
 
@@ -435,16 +617,15 @@ class Markdown:
         input_file.close()
         text = text.lstrip(u'\ufeff') # remove the byte-order mark
 
-        # Convert
-        html = self.convert(text)
-
-        # Write to file or stdout
+        # Convert, writing each piece of output as soon as it is ready
         if isinstance(output, (str, unicode)):
             output_file = codecs.open(output, "w", encoding=encoding)
-            output_file.write(html)
+            for html in self.convertIter(text):
+                output_file.write(html)
             output_file.close()
         else:
-            output.write(html.encode(encoding))
+            for html in self.convertIter(text):
+                output.write(html.encode(encoding))
 
 
 """
@@ -550,10 +731,13 @@ def load_extensions(ext_names):
 EXPORTED FUNCTIONS
 =============================================================================
 
-Those are the two functions we really mean to export: markdown() and
-markdownFromFile().
+Those are the functions we really mean to export: markdown(),
+markdownFromFile() and markdownFromFiles().
 """
 
+markdownPool = MarkdownPool()
+""" Instances used by markdown(); share it to avoid building your own. """
+
 def markdown(text,
              extensions = [],
              safe_mode = False,
@@ -580,11 +764,13 @@ def markdown(text,
 
     Returns: An HTML document as a string.
 
+    Instances are taken from `markdownPool` rather than built on every call.
+
     """
-    md = Markdown(extensions=load_extensions(extensions),
-                  safe_mode=safe_mode, 
-                  output_format=output_format)
-    return md.convert(text)
+    md = markdownPool.acquire(extensions, safe_mode, output_format)
+    html = md.convert(text)
+    markdownPool.release(md)
+    return html
 
 
 def markdownFromFile(input = None,
@@ -600,4 +786,102 @@ def markdownFromFile(input = None,
     md.convertFile(input, output, encoding)
 
 
+MARKDOWN_FILE_TYPES = ('.md', '.markdown', '.txt', '.text')
+""" Files picked up when a directory is passed to markdownFromFiles(). """
+
+def markdownFromFiles(inputs,
+                      output_dir = None,
+                      extensions = [],
+                      encoding = None,
+                      safe_mode = False,
+                      output_format = DEFAULT_OUTPUT_FORMAT,
+                      processes = None):
+    """Convert many markdown files, spreading the work over several processes.
+
+    Each input is written to a file of the same name with an ".html"
+    extension, next to the input or in `output_dir` if given.  Directories
+    are searched recursively for files ending in one of MARKDOWN_FILE_TYPES
+    and keep their layout under `output_dir`.
+
+    The files are shared out to a `multiprocessing` pool of `processes`
+    workers (one per CPU by default).  Each worker loads the extensions once
+    and reuses its Markdown instance for every file it is given, so
+    extensions passed as instances must be picklable.  Without
+    `multiprocessing`, or with `processes=1`, the files are converted in
+    this process.
+
+    Returns: A (files, bytes, seconds) tuple describing the batch.
 
+    """
+    jobs = [(input, output, encoding) for input, output
+            in _batchFiles(inputs, output_dir)]
+    options = {'extensions': extensions,
+               'safe_mode': safe_mode,
+               'output_format': output_format}
+    start = time.time()
+    pool = None
+    if processes != 1 and len(jobs) > 1:
+        try:
+            import multiprocessing
+            pool = multiprocessing.Pool(processes, _initBatchWorker, (options,))
+        except ImportError:
+            pass
+    if pool is not None:
+        try:
+            sizes = pool.map(_convertBatchFile, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _initBatchWorker(options)
+        sizes = map(_convertBatchFile, jobs)
+    return len(jobs), sum(sizes), time.time() - start
+
+
+def _batchFiles(inputs, output_dir):
+    """ Yield (input, output) file names for markdownFromFiles(). """
+    if isinstance(inputs, basestring):
+        inputs = [inputs]
+    for input in inputs:
+        if os.path.isdir(input):
+            for root, dirs, files in os.walk(input):
+                dirs.sort()
+                for name in sorted(files):
+                    if os.path.splitext(name)[1].lower() in MARKDOWN_FILE_TYPES:
+                        source = os.path.join(root, name)
+                        target = source
+                        if output_dir is not None:
+                            target = os.path.join(output_dir,
+                                                  os.path.relpath(source, input))
+                        yield source, os.path.splitext(target)[0] + '.html'
+        else:
+            target = input
+            if output_dir is not None:
+                target = os.path.join(output_dir, os.path.basename(input))
+            yield input, os.path.splitext(target)[0] + '.html'
+
+
+_batchMarkdown = None
+
+def _initBatchWorker(options):
+    """ Build the Markdown instance a batch worker reuses for every file. """
+    global _batchMarkdown
+    _batchMarkdown = Markdown(extensions=load_extensions(options['extensions']),
+                              safe_mode=options['safe_mode'],
+                              output_format=options['output_format'])
+
+
+def _convertBatchFile(job):
+    """ Convert one file of a batch and return the size of its source. """
+    input, output, encoding = job
+    directory = os.path.dirname(output)
+    if directory and not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Another worker may have created it first.
+            if not os.path.isdir(directory):
+                raise
+    _batchMarkdown.reset()
+    _batchMarkdown.convertFile(input, output, encoding)
+    return os.path.getsize(input)
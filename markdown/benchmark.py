@@ -0,0 +1,338 @@
+"""
+BENCHMARKS
+=============================================================================
+
+Times Python-Markdown on synthetic documents, so that changes to the
+package can be checked against a render budget:
+
+    python -m markdown.benchmark -s small -s large -o before.json
+
+Each corpus mixes one kind of markup (paragraphs, deep lists, links, raw
+html, tables, fenced code, footnotes) and is generated at several sizes
+from a fixed seed, so runs are comparable between trees and machines.
+For every document the report gives the best ``convert`` time over the
+repeats, the time spent in each stage and processor of the conversion as
+entered by MarkdownStats, and the peak memory of a fresh process
+converting it.  The time taken to build a Markdown instance is reported
+too.  The report is JSON.
+"""
+
+import os
+import sys
+import random
+import subprocess
+from timeit import default_timer as timer
+try:
+    import json
+except ImportError:
+    import simplejson as json
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import markdown
+
+DEFAULT_EXTENSIONS = ['extra']
+DEFAULT_REPEAT = 5
+SIZES = {'small': 10, 'medium': 100, 'large': 1000}
+DEFAULT_SIZES = ['small', 'medium']
+SEED = 2011
+
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do "
+         "eiusmod tempor incididunt ut labore et dolore magna aliqua").split()
+
+
+"""
+CORPORA
+=============================================================================
+
+Each function returns a document made of ``units`` repetitions of its
+markup, built from the given random.Random instance.
+"""
+
+def _words(rnd, count):
+    return " ".join([rnd.choice(WORDS) for i in range(count)])
+
+def _sentence(rnd):
+    words = [rnd.choice(WORDS) for i in range(rnd.randint(6, 14))]
+    i = rnd.randrange(len(words))
+    words[i] = rnd.choice(["*%s*", "**%s**", "`%s`", "_%s_"]) % words[i]
+    return " ".join(words).capitalize() + "."
+
+def paragraphs(rnd, units):
+    blocks = []
+    for unit in range(units):
+        blocks.append("## %s" % _words(rnd, 3).capitalize())
+        for i in range(3):
+            blocks.append("\n".join([_sentence(rnd) for j in range(4)]))
+    return "\n\n".join(blocks)
+
+def lists(rnd, units):
+    blocks = []
+    for unit in range(units):
+        items = []
+        for i in range(8):
+            depth = rnd.randint(0, 5)
+            marker = rnd.choice(["*", "-", "1."])
+            items.append("    " * depth + marker + " " + _sentence(rnd))
+        blocks.append("\n".join(items))
+        blocks.append(_sentence(rnd))
+    return "\n\n".join(blocks)
+
+def links(rnd, units):
+    blocks = []
+    for unit in range(units):
+        parts = []
+        for i in range(6):
+            word = rnd.choice(WORDS)
+            parts.append(rnd.choice([
+                "[%s](http://example.com/%s/%d \"%s\")" % (word, word, i, word),
+                "[%s][ref%d-%d]" % (word, unit, i),
+                "<http://example.com/%s>" % word,
+                "![%s](/img/%s.png)" % (word, word),
+            ]))
+            parts.append(_words(rnd, 5))
+        blocks.append(" ".join(parts))
+        blocks.append("\n".join(["[ref%d-%d]: http://example.com/ref/%d" %
+                                 (unit, i, i) for i in range(6)]))
+    return "\n\n".join(blocks)
+
+def html(rnd, units):
+    blocks = []
+    for unit in range(units):
+        blocks.append('<div class="embed">\n<iframe src="http://example.com/'
+                      'video/%d" width="640"></iframe>\n</div>' % unit)
+        blocks.append(_sentence(rnd) + ' <span class="note">%s</span> ' %
+                      _words(rnd, 3) + _sentence(rnd))
+        blocks.append("<table>\n<tr><td>%s</td><td>%s</td></tr>\n</table>" %
+                      (_words(rnd, 2), _words(rnd, 2)))
+    return "\n\n".join(blocks)
+
+def tables(rnd, units):
+    blocks = []
+    for unit in range(units):
+        rows = ["Name | Value | Notes", "---- | ----: | -----"]
+        for i in range(8):
+            rows.append("%s | %d | %s" % (rnd.choice(WORDS), rnd.randint(0, 999),
+                                          _words(rnd, 4)))
+        blocks.append("\n".join(rows))
+        blocks.append(_sentence(rnd))
+    return "\n\n".join(blocks)
+
+def code(rnd, units):
+    blocks = []
+    for unit in range(units):
+        lines = ["def %s_%d(x):" % (rnd.choice(WORDS), unit)]
+        for i in range(6):
+            lines.append("    x = x * %d + %d  # %s < &" %
+                         (i, rnd.randint(0, 9), rnd.choice(WORDS)))
+        lines.append("    return x")
+        blocks.append("~~~~\n%s\n~~~~" % "\n".join(lines))
+        blocks.append(_sentence(rnd))
+    return "\n\n".join(blocks)
+
+def footnotes(rnd, units):
+    blocks = []
+    notes = []
+    for unit in range(units):
+        blocks.append("%s[^n%d] %s[^m%d]" % (_sentence(rnd), unit,
+                                             _sentence(rnd), unit))
+        notes.append("[^n%d]: %s" % (unit, _sentence(rnd)))
+        notes.append("[^m%d]: %s\n\n    %s" % (unit, _sentence(rnd),
+                                               _sentence(rnd)))
+    return "\n\n".join(blocks + notes)
+
+def mixed(rnd, units):
+    return "\n\n".join([corpus(rnd, max(1, units / 7)) for name, corpus
+                        in CORPORA if corpus is not mixed])
+
+CORPORA = [
+    ('paragraphs', paragraphs),
+    ('lists', lists),
+    ('links', links),
+    ('html', html),
+    ('tables', tables),
+    ('code', code),
+    ('footnotes', footnotes),
+    ('mixed', mixed),
+]
+
+def makeDocument(name, size):
+    """ Return the document for a corpus at a size, as unicode. """
+    return unicode(dict(CORPORA)[name](random.Random(SEED), SIZES[size]))
+
+
+"""
+TIMING
+=============================================================================
+"""
+
+def convertByStage(md, source):
+    """
+    Convert source with statistics on, so the time of each stage and
+    processor is entered.  Return the output and a list of (stage, seconds)
+    pairs, named "kind:name" after the MarkdownStats entries.
+
+    """
+    stats = md.enableStats()
+    try:
+        output = md.convert(source)
+    finally:
+        md.disableStats()
+    return output, [("%s:%s" % key, entry['seconds'])
+                    for key, entry in sorted(stats.entries.items())]
+
+def benchConstruction(extensions, repeat):
+    """ Time building a Markdown instance with the extensions. """
+    best = None
+    for i in range(repeat):
+        start = timer()
+        markdown.Markdown(extensions=extensions)
+        elapsed = timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return {'seconds': best, 'ops_per_sec': _rate(1, best)}
+
+def benchDocument(name, size, extensions, repeat, memory=True):
+    """ Time converting the document for a corpus at a size. """
+    source = makeDocument(name, size)
+    md = markdown.Markdown(extensions=extensions)
+    best = None
+    stages = {}
+    for i in range(repeat):
+        md.reset()
+        start = timer()
+        md.convert(source)
+        elapsed = timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+        md.reset()
+        output, times = convertByStage(md, source)
+        for stage, seconds in times:
+            stages[stage] = min(stages.get(stage, seconds), seconds)
+    md.reset()
+    result = {
+        'corpus': name,
+        'size': size,
+        'bytes': len(source.encode('utf8')),
+        'seconds': best,
+        'ops_per_sec': _rate(1, best),
+        'bytes_per_sec': _rate(len(source.encode('utf8')), best),
+        'stages': [{'stage': stage, 'seconds': seconds}
+                   for stage, seconds in sorted(stages.items())],
+    }
+    if memory:
+        result['memory'] = measureMemory(name, size, extensions)
+    return result
+
+def _rate(amount, seconds):
+    if not seconds:
+        return None
+    return amount / seconds
+
+
+"""
+MEMORY
+=============================================================================
+
+Peak memory is only meaningful for a whole process, so each document is
+converted once more in a fresh interpreter.  Sizes are in kilobytes as
+reported by getrusage, which is not available on every platform.
+"""
+
+def measureMemory(name, size, extensions):
+    """
+    Return the peak resident size of a fresh process before and after
+    converting a document, or None where that can not be measured.
+
+    """
+    if resource is None:
+        return None
+    path = os.path.dirname(os.path.dirname(os.path.abspath(markdown.__file__)))
+    script = ("import sys; sys.path.insert(0, %r); "
+              "from markdown import benchmark; "
+              "benchmark._memoryChild(%r, %r, %r)" % (path, name, size, extensions))
+    child = subprocess.Popen([sys.executable, '-c', script],
+                             stdout=subprocess.PIPE)
+    output = child.communicate()[0]
+    if child.returncode:
+        return None
+    return json.loads(output)
+
+def _memoryChild(name, size, extensions):
+    source = makeDocument(name, size)
+    md = markdown.Markdown(extensions=extensions)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    md.convert(source)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    sys.stdout.write(json.dumps({'before_kb': before, 'peak_kb': peak,
+                                 'convert_kb': peak - before}))
+
+
+"""
+COMMAND LINE
+=============================================================================
+"""
+
+def run(corpora=None, sizes=DEFAULT_SIZES, extensions=DEFAULT_EXTENSIONS,
+        repeat=DEFAULT_REPEAT, memory=True):
+    """ Run the benchmarks and return the report as a dictionary. """
+    if not corpora:
+        corpora = [name for name, corpus in CORPORA]
+    return {
+        'markdown': markdown.version,
+        'python': sys.version.split()[0],
+        'extensions': extensions,
+        'repeat': repeat,
+        'construction': benchConstruction(extensions, repeat),
+        'documents': [benchDocument(name, size, extensions, repeat, memory)
+                      for size in sizes for name in corpora],
+    }
+
+def parse_options():
+    """ Define and parse `optparse` options for command-line usage. """
+    import optparse
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("-c", "--corpus", dest="corpora", action="append",
+                      choices=[name for name, corpus in CORPORA],
+                      help="corpus to run, may be repeated (default: all of %s)"
+                           % ", ".join([name for name, corpus in CORPORA]),
+                      metavar="CORPUS")
+    parser.add_option("-s", "--size", dest="sizes", action="append",
+                      choices=SIZES.keys(),
+                      help="document size, may be repeated: small, medium "
+                           "or large (default: small and medium)",
+                      metavar="SIZE")
+    parser.add_option("-x", "--extension", dest="extensions", action="append",
+                      help="load extension, may be repeated (default: extra)",
+                      metavar="EXTENSION")
+    parser.add_option("-n", "--repeat", dest="repeat", type="int",
+                      default=DEFAULT_REPEAT,
+                      help="runs per document; the best is reported "
+                           "(default: %d)" % DEFAULT_REPEAT)
+    parser.add_option("-o", "--output", dest="output",
+                      help="write the JSON report to OUTPUT_FILE instead "
+                           "of stdout", metavar="OUTPUT_FILE")
+    parser.add_option("--no-memory", dest="memory", action="store_false",
+                      default=True, help="do not measure peak memory")
+    (options, args) = parser.parse_args()
+    return options
+
+def main():
+    options = parse_options()
+    report = run(corpora=options.corpora,
+                 sizes=options.sizes or DEFAULT_SIZES,
+                 extensions=options.extensions or DEFAULT_EXTENSIONS,
+                 repeat=options.repeat,
+                 memory=options.memory)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if options.output:
+        output = open(options.output, "w")
+        output.write(text)
+        output.close()
+    else:
+        print text
+
+if __name__ == '__main__':
+    main()
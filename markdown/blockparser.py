@@ -1,5 +1,7 @@
 
+import inspect
 import markdown
+from collections import deque
 
 class State(list):
     """ Track the current and nested state of the parser. 
@@ -34,6 +36,43 @@ class State(list):
         else:
             return False
 
+class BlockStream(deque):
+    """ The remaining blocks of a document, consumed from the front.
+
+    BlockProcessors take the next block with ``blocks.pop(0)`` and put back
+    any part they did not use with ``blocks.insert(0, text)``, just as with a
+    list. On a BlockStream both take constant time, where on a list they
+    take time in proportion to the number of blocks left, so long documents
+    no longer parse in quadratic time.
+
+    Other positions work too, but cost as much as on a list. Slicing is not
+    supported.
+
+    """
+
+    def pop(self, index=-1):
+        """ Remove and return the block at index (the last by default). """
+        if index == 0:
+            return self.popleft()
+        if index == -1:
+            return deque.pop(self)
+        block = self[index]
+        del self[index]
+        return block
+
+    def insert(self, index, block):
+        """ Insert block before index. """
+        if index < 0:
+            index = max(len(self) + index, 0)
+        if index == 0:
+            self.appendleft(block)
+        elif index >= len(self):
+            self.append(block)
+        else:
+            self.rotate(-index)
+            self.appendleft(block)
+            self.rotate(index)
+
 class BlockParser:
     """ Parse Markdown blocks into an ElementTree object. 
     
@@ -44,6 +83,7 @@ class BlockParser:
     def __init__(self):
         self.blockprocessors = markdown.odict.OrderedDict()
         self.state = State()
+        self.dispatch = None
 
     def parseDocument(self, lines):
         """ Parse a markdown document into an ElementTree. 
@@ -56,10 +96,50 @@ class BlockParser:
 
         """
         # Create a ElementTree from the lines
+        self.buildDispatch()
         self.root = markdown.etree.Element(markdown.DOC_TAG)
         self.parseChunk(self.root, '\n'.join(lines))
         return markdown.etree.ElementTree(self.root)
 
+    def buildDispatch(self):
+        """ Index the blockprocessors by the first character of a block.
+
+        For each character named in a processor's ``START_CHARS``, the index
+        lists the processors that could accept a block starting with it, in
+        the order of ``blockprocessors``. Blocks starting with any other
+        character go to the processors whose ``START_CHARS`` is None.
+
+        ``START_CHARS`` only describes the ``test`` and ``RE`` declared with
+        it, so a subclass that overrides either without declaring its own
+        ``START_CHARS`` is treated as if it had none.
+
+        This is called for every document, so it picks up processors added
+        or removed since the last one. Call it again after changing
+        ``blockprocessors`` if you are calling ``parseBlocks`` yourself.
+
+        """
+        starts = [(processor, self._startChars(processor))
+                  for processor in self.blockprocessors.values()]
+        chars = {}
+        for processor, start in starts:
+            for char in start or '':
+                chars[char] = True
+        self.dispatch = {}
+        for char in chars:
+            self.dispatch[char] = [processor for processor, start in starts
+                                   if start is None or char in start]
+        self.dispatch[''] = [processor for processor, start in starts
+                             if start is None]
+
+    def _startChars(self, processor):
+        """ Return the START_CHARS that hold for a processor's test. """
+        for cls in inspect.getmro(processor.__class__):
+            if 'START_CHARS' in cls.__dict__:
+                return cls.START_CHARS
+            if 'test' in cls.__dict__ or 'RE' in cls.__dict__:
+                return None
+        return None
+
     def parseChunk(self, parent, text):
         """ Parse a chunk of markdown text and attach to given etree node. 
         
@@ -85,10 +165,18 @@ class BlockParser:
         BlockProcessors which call this method to recursively parse a nested
         block.
 
+        A plain list of ``blocks`` is copied into a BlockStream first.
+
         """
+        if not isinstance(blocks, BlockStream):
+            blocks = BlockStream(blocks)
+        if self.dispatch is None:
+            self.buildDispatch()
+        default = self.dispatch['']
         while blocks:
-           for processor in self.blockprocessors.values():
-               if processor.test(parent, blocks[0]):
+           block = blocks[0]
+           for processor in self.dispatch.get(block[:1], default):
+               if processor.test(parent, block):
                    processor.run(parent, blocks)
                    break
 
@@ -26,6 +26,11 @@ class BlockProcessor:
 
     """
 
+    # The characters a block must start with for ``test`` to pass, or None
+    # if it could start with anything. The parser only tests a processor on
+    # blocks that start with one of these.
+    START_CHARS = None
+
     def __init__(self, parser=None):
         self.parser = parser
 
@@ -97,7 +102,8 @@ class BlockProcessor:
         Keywords:
 
         * ``parent``: A etree element which is the parent of the current block.
-        * ``blocks``: A list of all remaining blocks of the document.
+        * ``blocks``: A BlockStream of all remaining blocks of the document.
+          Use ``blocks.pop(0)`` and ``blocks.insert(0, block)`` as with a list.
         """
         pass
 
@@ -113,6 +119,7 @@ class ListIndentProcessor(BlockProcessor):
 
     """
 
+    START_CHARS = ' '
     INDENT_RE = re.compile(r'^(([ ]{%s})+)'% markdown.TAB_LENGTH)
     ITEM_TYPES = ['li']
     LIST_TYPES = ['ul', 'ol']
@@ -186,6 +193,8 @@ class ListIndentProcessor(BlockProcessor):
 class CodeBlockProcessor(BlockProcessor):
     """ Process code blocks. """
 
+    START_CHARS = ' '
+
     def test(self, parent, block):
         return block.startswith(' '*markdown.TAB_LENGTH)
     
@@ -219,7 +228,7 @@ class BlockQuoteProcessor(BlockProcessor):
     RE = re.compile(r'(^|\n)[ ]{0,3}>[ ]?(.*)')
 
     def test(self, parent, block):
-        return bool(self.RE.search(block))
+        return '>' in block and bool(self.RE.search(block))
 
     def run(self, parent, blocks):
         block = blocks.pop(0)
@@ -256,6 +265,7 @@ class OListProcessor(BlockProcessor):
 
     TAG = 'ol'
     # Detect an item (``1. item``). ``group(1)`` contains contents of item.
+    START_CHARS = ' 0123456789'
     RE = re.compile(r'^[ ]{0,3}\d+\.[ ](.*)')
     # Detect items on secondary lines. they can be of either list type.
     CHILD_RE = re.compile(r'^[ ]{0,3}((\d+\.)|[*+-])[ ](.*)')
@@ -324,6 +334,7 @@ class UListProcessor(OListProcessor):
     """ Process unordered list blocks. """
 
     TAG = 'ul'
+    START_CHARS = ' *+-'
     RE = re.compile(r'^[ ]{0,3}[*+-][ ](.*)')
 
 
@@ -334,7 +345,7 @@ class HashHeaderProcessor(BlockProcessor):
     RE = re.compile(r'(^|\n)(?P<level>#{1,6})(?P<header>.*?)#*(\n|$)')
 
     def test(self, parent, block):
-        return bool(self.RE.search(block))
+        return '#' in block and bool(self.RE.search(block))
 
     def run(self, parent, blocks):
         block = blocks.pop(0)
@@ -391,7 +402,8 @@ class HRProcessor(BlockProcessor):
     MATCH_RE = re.compile(r'^%s$' % RE)
 
     def test(self, parent, block):
-        return bool(self.SEARCH_RE.search(block))
+        return ('*' in block or '-' in block or '_' in block) and \
+               bool(self.SEARCH_RE.search(block))
 
     def run(self, parent, blocks):
         lines = blocks.pop(0).split('\n')
@@ -420,6 +432,7 @@ class EmptyBlockProcessor(BlockProcessor):
 
     # Detect a block that only contains whitespace 
     # or only whitespace on the first line.
+    START_CHARS = ' \t\n\r\f\v'
     RE = re.compile(r'^\s*\n')
 
     def test(self, parent, block):
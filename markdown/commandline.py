@@ -7,6 +7,7 @@ Markdown is called from the command line.
 """
 
 import markdown
+import os
 import sys
 import logging
 from logging import DEBUG, INFO, WARN, ERROR, CRITICAL
@@ -42,10 +43,18 @@ def parse_options():
             print OPTPARSE_WARNING
             return None, None
 
-    parser = optparse.OptionParser(usage="%prog INPUTFILE [options]")
+    parser = optparse.OptionParser(usage="%prog INPUTFILE [INPUTFILE|DIR ...] [options]")
     parser.add_option("-f", "--file", dest="filename", default=sys.stdout,
                       help="write output to OUTPUT_FILE",
                       metavar="OUTPUT_FILE")
+    parser.add_option("-d", "--output_dir", dest="output_dir",
+                      help="with several inputs or a directory, write each "
+                           "INPUT.html to OUTPUT_DIR instead of next to INPUT",
+                      metavar="OUTPUT_DIR")
+    parser.add_option("-j", "--jobs", dest="processes", type="int",
+                      help="number of processes for several inputs "
+                           "(default: one per CPU)",
+                      metavar="JOBS")
     parser.add_option("-e", "--encoding", dest="encoding",
                       help="encoding for input and output files",)
     parser.add_option("-q", "--quiet", default = CRITICAL,
@@ -68,15 +77,24 @@ def parse_options():
 
     (options, args) = parser.parse_args()
 
-    if not len(args) == 1:
+    if not args:
         parser.print_help()
         return None, None
-    else:
-        input_file = args[0]
 
     if not options.extensions:
         options.extensions = []
 
+    if len(args) > 1 or os.path.isdir(args[0]):
+        return {'inputs': args,
+                'output_dir': options.output_dir,
+                'processes': options.processes,
+                'safe_mode': options.safe,
+                'extensions': options.extensions,
+                'encoding': options.encoding,
+                'output_format': options.output_format}, options.verbose
+
+    input_file = args[0]
+
     return {'input': input_file,
             'output': options.filename,
             'safe_mode': options.safe,
@@ -93,4 +111,12 @@ def run():
     if logging_level: logging.getLogger('MARKDOWN').setLevel(logging_level)
 
     # Run
-    markdown.markdownFromFile(**options)
+    if 'inputs' in options:
+        files, size, seconds = markdown.markdownFromFiles(**options)
+        seconds = max(seconds, 0.001)
+        sys.stderr.write("Converted %d files (%d bytes) in %.2fs: "
+                         "%.1f files/s, %.1f KB/s\n"
+                         % (files, size, seconds, files / seconds,
+                            size / seconds / 1024))
+    else:
+        markdown.markdownFromFile(**options)
@@ -34,8 +34,16 @@ class AbbrExtension(markdown.Extension):
 
     def extendMarkdown(self, md, md_globals):
         """ Insert AbbrPreprocessor before ReferencePreprocessor. """
+        md.registerExtension(self)
+        self.md = md
         md.preprocessors.add('abbr', AbbrPreprocessor(md), '<reference')
-        
+
+    def reset(self):
+        """ Remove the patterns added for the last document's abbreviations. """
+        for key in self.md.inlinePatterns.keys():
+            if key.startswith('abbr-'):
+                del self.md.inlinePatterns[key]
+
            
 class AbbrPreprocessor(markdown.preprocessors.Preprocessor):
     """ Abbreviation Preprocessor - parse text for abbr references. """
@@ -52,8 +60,10 @@ class AbbrPreprocessor(markdown.preprocessors.Preprocessor):
             if m:
                 abbr = m.group('abbr').strip()
                 title = m.group('title').strip()
-                self.markdown.inlinePatterns['abbr-%s'%abbr] = \
-                    AbbrPattern(self._generate_pattern(abbr), title)
+                pattern = AbbrPattern(self._generate_pattern(abbr), title)
+                pattern.triggers = (abbr,)
+                pattern.rescan = False
+                self.markdown.inlinePatterns['abbr-%s'%abbr] = pattern
             else:
                 new_text.append(line)
         return new_text
@@ -175,26 +175,26 @@ class CodeHilite:
 
 
 # ------------------ The Markdown Extension -------------------------------
-class HiliteTreeprocessor(markdown.treeprocessors.Treeprocessor):
+class HiliteTreeprocessor(markdown.treeprocessors.VisitingTreeprocessor):
     """ Hilight source code in code blocks. """
 
-    def run(self, root):
-        """ Find code blocks and store in htmlStash. """
-        blocks = root.getiterator('pre')
-        for block in blocks:
-            children = block.getchildren()
-            if len(children) == 1 and children[0].tag == 'code':
-                code = CodeHilite(children[0].text, 
-                            linenos=self.config['force_linenos'][0],
-                            css_class=self.config['css_class'][0])
-                placeholder = self.markdown.htmlStash.store(code.hilite(), 
-                                                            safe=True)
-                # Clear codeblock in etree instance
-                block.clear()
-                # Change to p element which will later 
-                # be removed when inserting raw html
-                block.tag = 'p'
-                block.text = placeholder
+    tags = ('pre',)
+
+    def visit(self, block, parent):
+        """ Store a code block in htmlStash. """
+        children = block.getchildren()
+        if len(children) == 1 and children[0].tag == 'code':
+            code = CodeHilite(children[0].text, 
+                        linenos=self.config['force_linenos'][0],
+                        css_class=self.config['css_class'][0])
+            placeholder = self.markdown.htmlStash.store(code.hilite(), 
+                                                        safe=True)
+            # Clear codeblock in etree instance
+            block.clear()
+            # Change to p element which will later 
+            # be removed when inserting raw html
+            block.tag = 'p'
+            block.text = placeholder
 
 
 class CodeHiliteExtension(markdown.Extension):
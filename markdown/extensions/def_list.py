@@ -29,7 +29,7 @@ class DefListProcessor(markdown.blockprocessors.BlockProcessor):
     RE = re.compile(r'(^|\n)[ ]{0,3}:[ ]{1,3}(.*?)(\n|$)')
 
     def test(self, parent, block):
-        return bool(self.RE.search(block))
+        return ':' in block and bool(self.RE.search(block))
 
     def run(self, parent, blocks):
         block = blocks.pop(0)
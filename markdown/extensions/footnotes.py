@@ -71,19 +71,16 @@ class FootnoteExtension(markdown.Extension):
 
     def findFootnotesPlaceholder(self, root):
         """ Return ElementTree Element that contains Footnote placeholder. """
-        def finder(element):
-            for child in element:
-                if child.text:
-                    if child.text.find(self.getConfig("PLACE_MARKER")) > -1:
-                        return child, True
-                if child.tail:
-                    if child.tail.find(self.getConfig("PLACE_MARKER")) > -1:
-                        return (child, element), False
-                finder(child)
-            return None
-                
-        res = finder(root)
-        return res
+        # Only the top-level elements are searched.
+        marker = self.getConfig("PLACE_MARKER")
+        for child in root:
+            if child.text:
+                if child.text.find(marker) > -1:
+                    return child, True
+            if child.tail:
+                if child.tail.find(marker) > -1:
+                    return (child, root), False
+        return None
 
     def setFootnote(self, id, text):
         """ Store a footnote for later retrieval. """
@@ -244,6 +241,8 @@ class FootnotePattern(markdown.inlinepatterns.Pattern):
     def __init__(self, pattern, footnotes):
         markdown.inlinepatterns.Pattern.__init__(self, pattern)
         self.footnotes = footnotes
+        self.triggers = ('[^',)
+        self.rescan = False
 
     def handleMatch(self, m):
         sup = etree.Element("sup")
@@ -283,6 +282,8 @@ class FootnoteTreeprocessor(markdown.treeprocessors.Treeprocessor):
 class FootnotePostprocessor(markdown.postprocessors.Postprocessor):
     """ Replace placeholders with html entities. """
 
+    streaming = True
+
     def run(self, text):
         text = text.replace(FN_BACKLINK_TEXT, "&#8617;")
         return text.replace(NBSP_PLACEHOLDER, "&#160;")
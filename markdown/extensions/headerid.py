@@ -90,7 +90,7 @@ class HeaderIdProcessor(markdown.blockprocessors.BlockProcessor):
     IDs = []
 
     def test(self, parent, block):
-        return bool(self.RE.search(block))
+        return '#' in block and bool(self.RE.search(block))
 
     def run(self, parent, blocks):
         block = blocks.pop(0)
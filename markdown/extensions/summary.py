@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+"""
+Summary Extension for Python-Markdown
+=====================================
+
+Renders a summary of a document in the same conversion as its body. The
+summary is everything before the first top-level split marker, which is a
+block containing only ``<!-- ~ -->`` by default.
+
+    >>> import markdown
+    >>> md = markdown.Markdown(extensions=['summary'])
+    >>> md.convert('Intro *text*\\n\\n<!-- ~ -->\\n\\nThe rest.')
+    u'<p>Intro <em>text</em></p>\\n<!-- ~ -->\\n\\n<p>The rest.</p>'
+    >>> md.Summary
+    u'<p>Intro <em>text</em></p>'
+
+Documents without a marker have no separate summary:
+
+    >>> md.convert('No marker here.')
+    u'<p>No marker here.</p>'
+    >>> md.Summary is None
+    True
+
+A marker at the very start gives an empty summary:
+
+    >>> md.convert('<!-- ~ -->\\n\\nAll body.')
+    u'<!-- ~ -->\\n\\n<p>All body.</p>'
+    >>> md.Summary
+    u''
+
+A marker nested inside a list or blockquote does not split the document:
+
+    >>> md.convert('* one\\n\\n    <!-- ~ -->\\n\\n* two')
+    u'<ul>\\n<li>\\n<p>one</p>\\n<!-- ~ -->\\n\\n</li>\\n<li>\\n<p>two</p>\\n</li>\\n</ul>'
+    >>> md.Summary is None
+    True
+
+Dependencies:
+* [Python 2.3+](http://python.org)
+* [Markdown 2.0+](http://www.freewisdom.org/projects/python-markdown/)
+
+"""
+
+import markdown
+
+
+class SummaryExtension(markdown.Extension):
+    """ Summary Extension for Python-Markdown. """
+
+    def __init__(self, configs):
+        # set defaults
+        self.config = {
+                'marker' : ['<!-- ~ -->', 'Block that ends the summary.']
+            }
+
+        for key, value in configs:
+            self.setConfig(key, value)
+
+    def extendMarkdown(self, md, md_globals):
+        """ Add SummaryProcessor and SummaryTreeprocessor to Markdown. """
+        md.registerExtension(self)
+        self.md = md
+        # The marker is raw html, so by the time the parser sees it the
+        # html_block preprocessor has swapped it for a stash placeholder.
+        self.processor = SummaryProcessor(md.parser)
+        self.processor.md = md
+        self.processor.ext = self
+        md.parser.blockprocessors.add('summary', self.processor, '_begin')
+        treeprocessor = SummaryTreeprocessor(md)
+        treeprocessor.ext = self
+        md.treeprocessors.add('summary', treeprocessor, '_end')
+
+    def reset(self):
+        self.split = None
+        self.md.Summary = None
+
+
+class SummaryProcessor(markdown.blockprocessors.BlockProcessor):
+    """ Record where the first top-level split marker falls. """
+
+    START_CHARS = markdown.preprocessors.HTML_PLACEHOLDER_PREFIX[0]
+
+    def test(self, parent, block):
+        return self.ext.split is None and parent is self.parser.root and \
+               block.startswith(markdown.preprocessors.HTML_PLACEHOLDER_PREFIX) \
+               and self._stashed(block) == self.ext.getConfig('marker')
+
+    def run(self, parent, blocks):
+        block = blocks.pop(0)
+        self.ext.split = len(parent)
+        # Emit the marker exactly as ParagraphProcessor would have, so the
+        # body is unchanged by the extension.
+        p = markdown.etree.SubElement(parent, 'p')
+        p.text = block.lstrip()
+
+    def _stashed(self, block):
+        """ Return the raw html stashed under a placeholder block, if any. """
+        prefix = markdown.preprocessors.HTML_PLACEHOLDER_PREFIX
+        block = block.strip()
+        if not block.endswith(markdown.ETX):
+            return None
+        try:
+            index = int(block[len(prefix):-len(markdown.ETX)])
+            return self.md.htmlStash.rawHtmlBlocks[index][0]
+        except (ValueError, IndexError):
+            return None
+
+
+class SummaryTreeprocessor(markdown.treeprocessors.Treeprocessor):
+    """ Render the elements before the split marker as Markdown.Summary. """
+
+    def run(self, root):
+        self.markdown.Summary = None
+        if self.ext.split == 0:
+            # The document starts with the marker.
+            self.markdown.Summary = u''
+        elif self.ext.split is not None:
+            summary = markdown.etree.Element(markdown.DOC_TAG)
+            for child in root[:self.ext.split]:
+                summary.append(child)
+            self.markdown.Summary = self.markdown.serializeTree(summary)
+        self.ext.split = None
+
+
+def makeExtension(configs=None):
+    return SummaryExtension(configs=configs)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
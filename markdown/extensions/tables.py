@@ -22,7 +22,8 @@ class TableProcessor(markdown.blockprocessors.BlockProcessor):
     """ Process Tables. """
 
     def test(self, parent, block):
-        rows = block.split('\n')
+        # Only the first two rows matter here.
+        rows = block.split('\n', 2)
         return (len(rows) > 2 and '|' in rows[0] and 
                 '|' in rows[1] and '-' in rows[1] and 
                 rows[1][0] in ['|', ':', '-'])
@@ -12,98 +12,107 @@ import markdown
 from markdown import etree
 import re
 
-class TocTreeprocessor(markdown.treeprocessors.Treeprocessor):
-    # Iterator wrapper to get parent and child all at once
-    def iterparent(self, root):
-        for parent in root.getiterator():
-            for child in parent:
-                yield parent, child
-
-    def run(self, doc):
-        div = etree.Element("div")
-        div.attrib["class"] = "toc"
-        last_li = None
+class TocTreeprocessor(markdown.treeprocessors.VisitingTreeprocessor):
+
+    def start(self, doc):
+        self.div = etree.Element("div")
+        self.div.attrib["class"] = "toc"
+        self.last_li = None
 
         # Add title to the div
         if self.config["title"][0]:
-            header = etree.SubElement(div, "span")
+            header = etree.SubElement(self.div, "span")
             header.attrib["class"] = "toctitle"
             header.text = self.config["title"][0]
 
-        level = 0
-        list_stack=[div]
-        header_rgx = re.compile("[Hh][123456]")
-
-        # Get a list of id attributes
-        used_ids = []
-        for c in doc.getiterator():
-            if "id" in c.attrib:
-                used_ids.append(c.attrib["id"])
-
-        for (p, c) in self.iterparent(doc):
-            if not c.text:
-                continue
-
-            # To keep the output from screwing up the
-            # validation by putting a <div> inside of a <p>
-            # we actually replace the <p> in its entirety.
-            # We do not allow the marker inside a header as that
-            # would causes an enless loop of placing a new TOC 
-            # inside previously generated TOC.
-
-            if c.text.find(self.config["marker"][0]) > -1 and not header_rgx.match(c.tag):
-                for i in range(len(p)):
-                    if p[i] == c:
-                        p[i] = div
-                        break
-                    
-            if header_rgx.match(c.tag):
-                tag_level = int(c.tag[-1])
+        self.level = 0
+        self.list_stack = [self.div]
+        self.header_rgx = re.compile("[Hh][123456]")
+
+        # Ids are given to headers once the walk has collected the id
+        # attributes of the whole document.
+        self.used_ids = []
+        if "id" in doc.attrib:
+            self.used_ids.append(doc.attrib["id"])
+        self.headers = []
+
+    def visit(self, c, p):
+        if "id" in c.attrib:
+            self.used_ids.append(c.attrib["id"])
+
+        if not c.text:
+            return
+
+        # To keep the output from screwing up the
+        # validation by putting a <div> inside of a <p>
+        # we actually replace the <p> in its entirety.
+        # We do not allow the marker inside a header as that
+        # would causes an enless loop of placing a new TOC 
+        # inside previously generated TOC.
+
+        if c.text.find(self.config["marker"][0]) > -1 and not self.header_rgx.match(c.tag):
+            for i in range(len(p)):
+                if p[i] == c:
+                    p[i] = self.div
+                    break
                 
-                # Regardless of how many levels we jumped
-                # only one list should be created, since
-                # empty lists containing lists are illegal.
-    
-                if tag_level < level:
-                    list_stack.pop()
-                    level = tag_level
-
-                if tag_level > level:
-                    newlist = etree.Element("ul")
-                    if last_li:
-                        last_li.append(newlist)
-                    else:
-                        list_stack[-1].append(newlist)
-                    list_stack.append(newlist)
-                    level = tag_level
-
-                # Do not override pre-existing ids 
-                if not "id" in c.attrib:
-                    id = self.config["slugify"][0](c.text)
-                    if id in used_ids:
-                        ctr = 1
-                        while "%s_%d" % (id, ctr) in used_ids:
-                            ctr += 1
-                        id = "%s_%d" % (id, ctr)
-                    used_ids.append(id)
-                    c.attrib["id"] = id
+        if self.header_rgx.match(c.tag):
+            tag_level = int(c.tag[-1])
+            
+            # Regardless of how many levels we jumped
+            # only one list should be created, since
+            # empty lists containing lists are illegal.
+
+            if tag_level < self.level:
+                self.list_stack.pop()
+                self.level = tag_level
+
+            if tag_level > self.level:
+                newlist = etree.Element("ul")
+                if self.last_li:
+                    self.last_li.append(newlist)
                 else:
-                    id = c.attrib["id"]
-
-                # List item link, to be inserted into the toc div
-                last_li = etree.Element("li")
-                link = etree.SubElement(last_li, "a")
-                link.text = c.text
-                link.attrib["href"] = '#' + id
-
-                if int(self.config["anchorlink"][0]):
-                    anchor = etree.SubElement(c, "a")
-                    anchor.text = c.text
-                    anchor.attrib["href"] = "#" + id
-                    anchor.attrib["class"] = "toclink"
-                    c.text = ""
-
-                list_stack[-1].append(last_li)
+                    self.list_stack[-1].append(newlist)
+                self.list_stack.append(newlist)
+                self.level = tag_level
+
+            # Do not override pre-existing ids 
+            if not "id" in c.attrib:
+                slug = self.config["slugify"][0](c.text)
+            else:
+                slug = None
+
+            # List item link, to be inserted into the toc div
+            self.last_li = etree.Element("li")
+            link = etree.SubElement(self.last_li, "a")
+            link.text = c.text
+
+            anchor = None
+            if int(self.config["anchorlink"][0]):
+                anchor = etree.SubElement(c, "a")
+                anchor.text = c.text
+                anchor.attrib["class"] = "toclink"
+                c.text = ""
+
+            self.list_stack[-1].append(self.last_li)
+            self.headers.append((c, slug, link, anchor))
+
+    def end(self, doc):
+        for c, id, link, anchor in self.headers:
+            if id is not None:
+                if id in self.used_ids:
+                    ctr = 1
+                    while "%s_%d" % (id, ctr) in self.used_ids:
+                        ctr += 1
+                    id = "%s_%d" % (id, ctr)
+                self.used_ids.append(id)
+                c.attrib["id"] = id
+            else:
+                id = c.attrib["id"]
+            link.attrib["href"] = '#' + id
+            if anchor is not None:
+                anchor.attrib["href"] = "#" + id
+        self.headers = None
 
 class TocExtension(markdown.Extension):
     def __init__(self, configs):
@@ -115,6 +115,8 @@ class WikiLinks(markdown.inlinepatterns.Pattern):
     def __init__(self, pattern, config):
         markdown.inlinepatterns.Pattern.__init__(self, pattern)
         self.config = config
+        self.triggers = ('[[',)
+        self.rescan = False
   
     def handleMatch(self, m):
         if m.group(2).strip():
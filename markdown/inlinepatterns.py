@@ -20,6 +20,13 @@ capture the whole block.  For this reason, they all start with
 '^(.*)' and end with '(.*)!'.  In case with built-in expression
 Pattern takes care of adding the "^(.*)" and "(.*)!".
 
+Pattern objects also provide pattern.getSearchRegExp(), which finds the
+expression anywhere in a block with the surrounding groups left empty, so
+that InlineProcessor can apply each pattern in a single pass over the
+text.  Patterns that don't subclass Pattern, or that supply their own
+expression through getCompiledRegExp() or compiled_re, are applied the
+old way.
+
 Finally, the order in which regular expressions are applied is very
 important - e.g. if we first replace http://.../ links with <a> tags
 and _then_ try to replace inline html, we would end up with a mess.
@@ -43,6 +50,7 @@ So, we apply the expressions in the following order:
 
 import markdown
 import re
+from collections import deque
 from urlparse import urlparse, urlunparse
 import sys
 if sys.version >= "3.0":
@@ -91,6 +99,33 @@ LINE_BREAK_RE = r'  \n'                     # two spaces at end of line
 LINE_BREAK_2_RE = r'  $'                    # two spaces at end of text
 
 
+# Expressions that can match around an earlier match of their own, as a link
+# can once the link inside its brackets has been replaced by a placeholder.
+NESTED_PATTERNS = (LINK_RE, IMAGE_LINK_RE, REFERENCE_RE, IMAGE_REFERENCE_RE)
+
+# Substrings that must be in a block for the expression to match; a pattern
+# is skipped for blocks containing none of them.
+PATTERN_TRIGGERS = {
+    BACKTICK_RE: ('`',),
+    ESCAPE_RE: ('\\',),
+    EMPHASIS_RE: ('*',),
+    STRONG_RE: ('**', '__'),
+    STRONG_EM_RE: ('***', '___'),
+    EMPHASIS_2_RE: ('_',),
+    LINK_RE: ('](',),
+    IMAGE_LINK_RE: ('![',),
+    REFERENCE_RE: ('[',),
+    IMAGE_REFERENCE_RE: ('![',),
+    NOT_STRONG_RE: (' * ',),
+    AUTOLINK_RE: ('://',),
+    AUTOMAIL_RE: ('@',),
+    HTML_RE: ('<',),
+    ENTITY_RE: ('&',),
+    LINE_BREAK_RE: ('  \n',),
+    LINE_BREAK_2_RE: ('  ',),
+}
+
+
 def dequote(string):
     """Remove quotes from around a string."""
     if ( ( string.startswith('"') and string.endswith('"'))
@@ -108,6 +143,41 @@ def handleAttributes(text, parent):
     return ATTR_RE.sub(attributeCallback, text)
 
 
+"""
+The compiled pattern cache
+-----------------------------------------------------------------------------
+"""
+
+COMPILED_CACHE_SIZE = 512 # most compiled expressions kept at once
+
+MATCH_TEMPLATE = "^(.*?)%s(.*?)$"   # matches a whole block
+SEARCH_TEMPLATE = "()%s()"          # finds the pattern within a block
+
+_compiled = {}
+_compiledOrder = deque()
+
+def compilePattern(pattern, template=MATCH_TEMPLATE):
+    """
+    Return the compiled expression used to apply `pattern` to a block of
+    text.  Expressions are shared by all Pattern instances, so building a
+    Markdown instance does not recompile the built-in patterns, and the
+    patterns added per document by extensions such as abbr are compiled
+    once.  The oldest entries are dropped when the cache is full.
+
+    """
+    key = (template, pattern)
+    try:
+        return _compiled[key]
+    except KeyError:
+        pass
+    compiled = re.compile(template % pattern, re.DOTALL)
+    if len(_compiled) >= COMPILED_CACHE_SIZE:
+        _compiled.pop(_compiledOrder.popleft(), None)
+    _compiled[key] = compiled
+    _compiledOrder.append(key)
+    return compiled
+
+
 """
 The pattern classes
 -----------------------------------------------------------------------------
@@ -126,7 +196,14 @@ class Pattern:
 
         """
         self.pattern = pattern
-        self.compiled_re = re.compile("^(.*?)%s(.*?)$" % pattern, re.DOTALL)
+        self.compiled_re = None
+        self.search_re = None
+        self.triggers = PATTERN_TRIGGERS.get(pattern)
+        # Search a block again after each match, unless the expression is
+        # known not to need it.  Nested patterns only search again from the
+        # first bracket left open before the match; others from the start.
+        self.nested = pattern in NESTED_PATTERNS
+        self.rescan = pattern not in PATTERN_TRIGGERS or self.nested
 
         # Api for Markdown to pass safe_mode into instance
         self.safe_mode = False
@@ -135,8 +212,35 @@ class Pattern:
 
     def getCompiledRegExp (self):
         """ Return a compiled regular expression. """
+        if self.compiled_re is None:
+            self.compiled_re = compilePattern(self.pattern)
         return self.compiled_re
 
+    def getSearchRegExp (self):
+        """
+        Return a compiled regular expression that finds the pattern anywhere
+        in a block.  Its groups are numbered as in getCompiledRegExp(), but
+        the first and last groups are empty rather than holding the text
+        before and after the match.
+
+        Return None if the expression of the pattern is not the one built
+        from self.pattern, because a subclass overrides getCompiledRegExp()
+        or sets compiled_re.  Such patterns are applied the old way.
+
+        """
+        if getattr(self.getCompiledRegExp, 'im_func', None) is not \
+                Pattern.getCompiledRegExp.im_func:
+            return None
+        if self.compiled_re is not None:
+            own = compilePattern(self.pattern)
+            if self.compiled_re is not own and \
+                    (self.compiled_re.pattern, self.compiled_re.flags) != \
+                    (own.pattern, own.flags):
+                return None
+        if self.search_re is None:
+            self.search_re = compilePattern(self.pattern, SEARCH_TEMPLATE)
+        return self.search_re
+
     def handleMatch(self, m):
         """Return a ElementTree element from the given match.
 
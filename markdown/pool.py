@@ -0,0 +1,100 @@
+"""
+MARKDOWN INSTANCE POOL
+=============================================================================
+
+Building a Markdown instance loads its extensions and creates every
+processor and inline pattern, which costs more than converting a short
+document.  A MarkdownPool keeps built instances for reuse, keyed by the
+arguments they were built with, and can be shared between threads:
+
+    md = pool.acquire(['footnotes'], safe_mode='escape')
+    html = md.convert(text)
+    pool.release(md)
+
+Each instance is used by one caller at a time and is reset() when it comes
+back, so it is as good as new for the next caller.  An instance whose
+conversion raised an exception may be left half way through a document and
+should not be released; it is simply dropped.
+"""
+
+try:
+    import threading
+except ImportError:
+    import dummy_threading as threading
+
+import markdown
+
+
+class MarkdownPool:
+    """ A thread-safe pool of Markdown instances. """
+
+    def __init__(self, size=4):
+        """
+        Create an empty pool.
+
+        Keyword arguments:
+
+        * size: Number of idle instances kept for each set of arguments.
+
+        """
+        self.size = size
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, extensions=[], safe_mode=False,
+                output_format=markdown.DEFAULT_OUTPUT_FORMAT):
+        """
+        Return a Markdown instance built with the given arguments, which
+        are the same as those of markdown.markdown().  Pass it back to
+        release() when done.
+
+        """
+        key = self._key(extensions, safe_mode, output_format)
+        if key is not None:
+            self.lock.acquire()
+            try:
+                instances = self.idle.get(key)
+                if instances:
+                    return instances.pop()
+            finally:
+                self.lock.release()
+        md = markdown.Markdown(extensions=markdown.load_extensions(extensions),
+                               safe_mode=safe_mode,
+                               output_format=output_format)
+        md.poolKey = key
+        return md
+
+    def release(self, md):
+        """ Reset an instance from acquire() and keep it for reuse. """
+        key = getattr(md, 'poolKey', None)
+        if key is None:
+            return
+        md.reset()
+        self.lock.acquire()
+        try:
+            instances = self.idle.setdefault(key, [])
+            if len(instances) < self.size:
+                instances.append(md)
+        finally:
+            self.lock.release()
+
+    def clear(self):
+        """ Drop all idle instances. """
+        self.lock.acquire()
+        try:
+            self.idle.clear()
+        finally:
+            self.lock.release()
+
+    def _key(self, extensions, safe_mode, output_format):
+        """
+        Return the key that instances built with these arguments are kept
+        under, or None if they cannot be shared.  Extension instances may
+        carry state of their own, so only extensions given by name are
+        pooled.
+
+        """
+        for extension in extensions:
+            if not isinstance(extension, basestring):
+                return None
+        return (tuple(extensions), safe_mode, output_format)
@@ -9,6 +9,8 @@ processing.
 """
 
 
+import re
+
 import markdown
 
 class Processor:
@@ -25,8 +27,14 @@ class Postprocessor(Processor):
 
     Postprocessors must extend markdown.Postprocessor.
 
+    Set ``streaming`` to True if running the postprocessor on each top-level
+    element of the document separately gives the same result as running it
+    on the whole document, so that Markdown.convertIter can stream output.
+
     """
 
+    streaming = False
+
     def run(self, text):
         """
         Subclasses of Postprocessor should implement a `run` method, which
@@ -40,8 +48,75 @@ class Postprocessor(Processor):
 class RawHtmlPostprocessor(Postprocessor):
     """ Restore raw html to the document. """
 
+    streaming = True
+
+    # The stash last checked by adjoins(), its length and the answer.
+    checked = None
+
+    # A placeholder, either alone in a paragraph or anywhere in the text.
+    RE = re.compile(r'<p>%(ph)s</p>|%(ph)s' % {'ph':
+                    re.escape(markdown.preprocessors.HTML_PLACEHOLDER_PREFIX)
+                    + r'(0|[1-9][0-9]*)' + re.escape(markdown.ETX)})
+
     def run(self, text):
         """ Iterate over html stash and restore "safe" html. """
+        if not self.markdown.htmlStash.html_counter:
+            return text
+        if self.adjoins():
+            return self.restoreInOrder(text)
+        self.restored = {}
+        try:
+            return self.restore(text, -1)
+        finally:
+            self.restored = None
+
+    def restore(self, text, after):
+        """
+        Replace every placeholder in the text for a stashed block numbered
+        higher than ``after`` in a single scan.  Blocks are restored in
+        order, so a placeholder within a block is only replaced if it is
+        for a later block.
+
+        """
+        def replace(m):
+            if m.group(1) is None:
+                index, wrapped = int(m.group(2)), False
+            else:
+                index, wrapped = int(m.group(1)), True
+            if index <= after or \
+               index >= self.markdown.htmlStash.html_counter:
+                return m.group(0)
+            return self.block(index, wrapped)
+        return self.RE.sub(replace, text)
+
+    def adjoins(self):
+        """
+        Check if restoring a block could leave a later placeholder alone in
+        a paragraph, as a block ending with ``<p>``, starting with ``</p>``
+        or holding placeholders can.  The single scan of restore() would
+        miss that, so such documents are restored one block at a time.
+
+        """
+        stash = self.markdown.htmlStash
+        # convertIter runs this for every top-level element, so the answer
+        # is kept until the stash changes.
+        checked = self.checked
+        if checked is not None and checked[0] is stash.rawHtmlBlocks and \
+           checked[1] == stash.html_counter:
+            return checked[2]
+        safeMode = self.markdown.safeMode
+        adjoins = False
+        for html, safe in stash.rawHtmlBlocks[:stash.html_counter]:
+            # Blocks the safe mode removes or escapes hold no tags.
+            if (safe or not safeMode) and (html.endswith("<p>") or
+                    html.startswith("</p>") or markdown.STX in html):
+                adjoins = True
+                break
+        self.checked = (stash.rawHtmlBlocks, stash.html_counter, adjoins)
+        return adjoins
+
+    def restoreInOrder(self, text):
+        """ Restore the stashed blocks one at a time. """
         for i in range(self.markdown.htmlStash.html_counter):
             html, safe  = self.markdown.htmlStash.rawHtmlBlocks[i]
             if self.markdown.safeMode and not safe:
@@ -59,6 +134,33 @@ class RawHtmlPostprocessor(Postprocessor):
                                  html)
         return text
 
+    def block(self, index, wrapped):
+        """
+        Return the html to restore for a stashed block, given whether its
+        placeholder is alone in a paragraph.
+
+        """
+        key = (index, wrapped)
+        if key not in self.restored:
+            html, safe = self.markdown.htmlStash.rawHtmlBlocks[index]
+            safeMode = self.markdown.safeMode
+            if safeMode and not safe:
+                if str(safeMode).lower() == 'escape':
+                    html = self.escape(html)
+                elif str(safeMode).lower() == 'remove':
+                    html = ''
+                else:
+                    html = markdown.HTML_REMOVED_TEXT
+            if wrapped:
+                if safe or not safeMode:
+                    html += "\n"
+                else:
+                    html = "<p>%s</p>" % html
+            if markdown.STX in html:
+                html = self.restore(html, index)
+            self.restored[key] = html
+        return self.restored[key]
+
     def escape(self, html):
         """ Basic html escaping """
         html = html.replace('&', '&amp;')
@@ -69,6 +171,9 @@ class RawHtmlPostprocessor(Postprocessor):
 
 class AndSubstitutePostprocessor(Postprocessor):
     """ Restore valid entities """
+
+    streaming = True
+
     def __init__(self):
         pass
 
@@ -114,11 +114,20 @@ class HtmlBlockPreprocessor(Preprocessor):
         right_tag = ''
         in_tag = False # flag
 
-        while text:
-            block = text[0]
+        # Walk the blocks with an index rather than slicing the list.  What
+        # follows a closing tag within a block is pushed back to be handled
+        # as the next block.
+        index = 0
+        pushback = None
+        while pushback is not None or index < len(text):
+            if pushback is not None:
+                block = pushback
+                pushback = None
+            else:
+                block = text[index]
+                index += 1
             if block.startswith("\n"):
                 block = block[1:]
-            text = text[1:]
 
             if block.startswith("\n"):
                 block = block[1:]
@@ -129,7 +138,7 @@ class HtmlBlockPreprocessor(Preprocessor):
                     right_tag, data_index = self._get_right_tag(left_tag, block)
 
                     if data_index < len(block):
-                        text.insert(0, block[data_index:])
+                        pushback = block[data_index:]
                         block = block[:data_index]
 
                     if not (markdown.isBlockLevel(left_tag) \
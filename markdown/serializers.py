@@ -0,0 +1,174 @@
+"""
+FRAGMENT SERIALIZERS
+=============================================================================
+
+Serialize the content of an element -- its text and children, but not its
+own tags or tail -- straight to a unicode string.  Markdown uses these to
+render the document root, which would otherwise be serialized to a byte
+string, decoded and have its wrapping tags sliced off again.
+
+The output matches that of the ElementTree 1.3 serializers for "xml"
+(``to_xhtml_fragment``) and "html" (``to_html_fragment``) with a utf8
+encoding.  As nothing is encoded, no characters are replaced with
+character references.
+"""
+
+import markdown
+from markdown import html4
+
+QName = markdown.etree.QName
+# cElementTree tags comments and processing instructions with the factories
+# of the Python implementation, so take the tags from elements it makes.
+Comment = markdown.etree.Comment().tag
+ProcessingInstruction = markdown.etree.ProcessingInstruction("pi").tag
+
+
+def _escape_cdata(text):
+    """ Escape character data. """
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    return text
+
+def _escape_attrib(text):
+    """ Escape an attribute value for xhtml. """
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    if "\"" in text:
+        text = text.replace("\"", "&quot;")
+    if "\n" in text:
+        text = text.replace("\n", "&#10;")
+    return text
+
+def _escape_attrib_html(text):
+    """ Escape an attribute value for html. """
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    if "\"" in text:
+        text = text.replace("\"", "&quot;")
+    return text
+
+def _qname(name, qnames, namespaces):
+    """ Return the serialized form of a tag or attribute name. """
+    if isinstance(name, QName):
+        name = name.text
+    try:
+        return qnames[name]
+    except KeyError:
+        pass
+    qname = name
+    if name[:1] == "{":
+        uri, local = name[1:].split("}", 1)
+        prefix = namespaces.get(uri)
+        if prefix is None:
+            prefix = html4._namespace_map.get(uri)
+            if prefix is None:
+                prefix = "ns%d" % len(namespaces)
+            if prefix != "xml":
+                namespaces[uri] = prefix
+        if prefix:
+            qname = "%s:%s" % (prefix, local)
+        else:
+            qname = local
+    qnames[name] = qname
+    return qname
+
+def _attributes(write, elem, escape, qnames, namespaces):
+    """ Write the attributes of an element in lexical order. """
+    items = elem.items()
+    if items:
+        items.sort()
+        for k, v in items:
+            if isinstance(v, QName):
+                v = _qname(v, qnames, namespaces)
+            else:
+                v = escape(v)
+            write(u" %s=\"%s\"" % (_qname(k, qnames, namespaces), v))
+
+def _serialize_xhtml(write, elem, qnames, namespaces):
+    tag = elem.tag
+    text = elem.text
+    if tag is Comment:
+        write(u"<!--%s-->" % text)
+    elif tag is ProcessingInstruction:
+        write(u"<?%s?>" % text)
+    else:
+        tag = _qname(tag, qnames, namespaces)
+        if tag is None:
+            if text:
+                write(_escape_cdata(text))
+            for e in elem:
+                _serialize_xhtml(write, e, qnames, namespaces)
+        else:
+            write(u"<" + tag)
+            _attributes(write, elem, _escape_attrib, qnames, namespaces)
+            if text or len(elem):
+                write(u">")
+                if text:
+                    write(_escape_cdata(text))
+                for e in elem:
+                    _serialize_xhtml(write, e, qnames, namespaces)
+                write(u"</" + tag + u">")
+            else:
+                write(u" />")
+    if elem.tail:
+        write(_escape_cdata(elem.tail))
+
+def _serialize_html(write, elem, qnames, namespaces):
+    tag = elem.tag
+    text = elem.text
+    if tag is Comment:
+        write(u"<!--%s-->" % _escape_cdata(text))
+    elif tag is ProcessingInstruction:
+        write(u"<?%s?>" % _escape_cdata(text))
+    else:
+        tag = _qname(tag, qnames, namespaces)
+        if tag is None:
+            if text:
+                write(_escape_cdata(text))
+            for e in elem:
+                _serialize_html(write, e, qnames, namespaces)
+        else:
+            write(u"<" + tag)
+            _attributes(write, elem, _escape_attrib_html, qnames, namespaces)
+            write(u">")
+            tag = tag.lower()
+            if text:
+                if tag == "script" or tag == "style":
+                    write(text)
+                else:
+                    write(_escape_cdata(text))
+            for e in elem:
+                _serialize_html(write, e, qnames, namespaces)
+            if tag not in html4.HTML_EMPTY:
+                write(u"</" + tag + u">")
+    if elem.tail:
+        write(_escape_cdata(elem.tail))
+
+def _fragment(serialize, element):
+    data = []
+    write = data.append
+    qnames = {None: None}
+    namespaces = {}
+    if element.text:
+        write(_escape_cdata(element.text))
+    for child in element:
+        serialize(write, child, qnames, namespaces)
+    return u"".join(data)
+
+def to_xhtml_fragment(element):
+    """ Serialize the text and children of an element as xhtml. """
+    return _fragment(_serialize_xhtml, element)
+
+def to_html_fragment(element):
+    """ Serialize the text and children of an element as html. """
+    return _fragment(_serialize_html, element)
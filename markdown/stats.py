@@ -0,0 +1,208 @@
+"""
+CONVERSION STATISTICS
+=============================================================================
+
+Records where a Markdown instance spends its time.  Statistics are off by
+default; switch them on for an instance with enableStats():
+
+    stats = md.enableStats()
+    md.convert(text)
+    print stats.report()
+
+Every preprocessor, blockprocessor, inline pattern, treeprocessor and
+postprocessor gets an entry, named by its kind and the key it was
+registered under (``"inline", "link"`` for instance), with the number of
+calls and the seconds spent.  The seconds of an entry do not include time
+spent in other entries it calls, so a list's blockprocessor is not charged
+for the paragraphs parsed inside it, and the entries add up to about the
+time spent converting.  The work Markdown does itself between processors is
+entered under the "stage" kind: "build" for normalizing the source and
+running the processors in turn, "parse" for the block parser and
+"serialize" for serializing the tree.
+
+Some entries count more than calls:
+
+* blockprocessor: ``tests`` is the number of blocks the processor was
+  asked about; ``calls`` is the number it accepted and ran on.
+* inline: ``calls`` is the number of texts the pattern was tried on and
+  ``matches`` the number of elements it created.
+* treeprocessor: ``visits`` is the number of elements a visiting
+  treeprocessor was shown during a shared walk.
+
+Statistics are gathered by wrapping the methods of the processors that are
+registered when enableStats() is called; disableStats() puts the methods
+back, so an instance without statistics runs at full speed.  Call
+enableStats() again after registering more processors.
+
+Entries accumulate over conversions until reset() is called, and the
+entries of several MarkdownStats objects can be added together with
+add(), for instance to gather the statistics of a pool of instances.
+A MarkdownStats object should only be used by one thread at a time.
+"""
+
+from timeit import default_timer as timer
+
+from markdown import treeprocessors
+
+STAGE = "stage"
+PREPROCESSOR = "preprocessor"
+BLOCKPROCESSOR = "blockprocessor"
+INLINE = "inline"
+TREEPROCESSOR = "treeprocessor"
+POSTPROCESSOR = "postprocessor"
+
+
+class MarkdownStats:
+    """ Call counts and timings of the processors of Markdown instances. """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """ Forget all entries. """
+        self.entries = {}
+        self.nested = []
+
+    def entry(self, kind, name):
+        """ Return the entry for a processor, creating it if needed. """
+        key = (kind, name)
+        try:
+            return self.entries[key]
+        except KeyError:
+            entry = self.entries[key] = {'calls': 0, 'seconds': 0.0}
+            return entry
+
+    def call(self, kind, name, func, *args):
+        """
+        Call func with args, entering the call and the time it took under
+        kind and name, and return its result.
+
+        """
+        return self.time(kind, name, 'calls', func, *args)
+
+    def time(self, kind, name, counter, func, *args):
+        """
+        Call func with args and return its result, adding the time it took
+        to the entry for kind and name and one to the given counter of the
+        entry.  If counter is None, only the time is added.
+
+        """
+        self.nested.append(0.0)
+        start = timer()
+        try:
+            return func(*args)
+        finally:
+            elapsed = timer() - start
+            inner = self.nested.pop()
+            if self.nested:
+                self.nested[-1] += elapsed
+            entry = self.entry(kind, name)
+            entry['seconds'] += elapsed - inner
+            if counter is not None:
+                entry[counter] = entry.get(counter, 0) + 1
+
+    def count(self, kind, name, **counts):
+        """ Add to the counters of an entry. """
+        entry = self.entry(kind, name)
+        for counter, value in counts.items():
+            entry[counter] = entry.get(counter, 0) + value
+
+    def add(self, other):
+        """ Add the entries of another MarkdownStats object to this one. """
+        for (kind, name), counts in other.entries.items():
+            entry = self.entry(kind, name)
+            for counter, value in counts.items():
+                entry[counter] = entry.get(counter, 0) + value
+
+    def total(self):
+        """ Return the seconds of all entries together. """
+        return sum([entry['seconds'] for entry in self.entries.values()])
+
+    def items(self):
+        """
+        Return a list of ((kind, name), entry) pairs, the slowest first.
+
+        """
+        items = self.entries.items()
+        items.sort(key=lambda item: (-item[1]['seconds'], item[0]))
+        return items
+
+    def report(self):
+        """ Return a table of the entries, the slowest first. """
+        lines = ["%-40s %8s %10s  %s" % ("processor", "calls", "seconds",
+                                         "counts")]
+        for (kind, name), entry in self.items():
+            counts = ["%s=%d" % (counter, value)
+                      for counter, value in sorted(entry.items())
+                      if counter not in ('calls', 'seconds')]
+            lines.append("%-40s %8d %10.6f  %s" % ("%s:%s" % (kind, name),
+                         entry['calls'], entry['seconds'], " ".join(counts)))
+        lines.append("%-40s %8s %10.6f" % ("total", "", self.total()))
+        return "\n".join(lines)
+
+    def instrument(self, md):
+        """
+        Wrap the methods of the processors of a Markdown instance so that
+        their calls are entered here.  Return a list of the attributes
+        replaced, to be put back with restore().
+
+        """
+        patches = []
+        def patch(obj, attr, wrapper, *args):
+            patches.append((obj, attr, obj.__dict__.get(attr, _MISSING)))
+            setattr(obj, attr, wrapper(self, getattr(obj, attr), *args))
+
+        patch(md, 'buildTree', _timed, STAGE, "build", 'calls')
+        patch(md.parser, 'parseDocument', _timed, STAGE, "parse", 'calls')
+        patch(md, 'serializeTree', _timed, STAGE, "serialize", 'calls')
+        for name, processor in md.preprocessors.items():
+            patch(processor, 'run', _timed, PREPROCESSOR, name, 'calls')
+        for name, processor in md.parser.blockprocessors.items():
+            patch(processor, 'test', _timed, BLOCKPROCESSOR, name, 'tests')
+            patch(processor, 'run', _timed, BLOCKPROCESSOR, name, 'calls')
+        for name, pattern in md.inlinePatterns.items():
+            patch(pattern, 'handleMatch', _counted, name)
+        for name, processor in md.treeprocessors.items():
+            if isinstance(processor, treeprocessors.VisitingTreeprocessor):
+                # Visiting treeprocessors share a walk, so each part is timed.
+                patch(processor, 'start', _timed, TREEPROCESSOR, name, 'calls')
+                patch(processor, 'visit', _timed, TREEPROCESSOR, name, 'visits')
+                patch(processor, 'end', _timed, TREEPROCESSOR, name, None)
+                continue
+            patch(processor, 'run', _timed, TREEPROCESSOR, name, 'calls')
+            if isinstance(processor, treeprocessors.InlineProcessor):
+                patch(processor, 'applyPattern', _timedPattern,
+                      md.inlinePatterns)
+        for name, processor in md.postprocessors.items():
+            patch(processor, 'run', _timed, POSTPROCESSOR, name, 'calls')
+        return patches
+
+    def restore(self, patches):
+        """ Put back the attributes replaced by instrument(). """
+        for obj, attr, value in reversed(patches):
+            if value is _MISSING:
+                delattr(obj, attr)
+            else:
+                setattr(obj, attr, value)
+
+
+_MISSING = object()
+
+def _timed(stats, func, kind, name, counter):
+    def timed(*args):
+        return stats.time(kind, name, counter, func, *args)
+    return timed
+
+def _counted(stats, handleMatch, name):
+    def counted(m):
+        node = handleMatch(m)
+        if node is not None:
+            stats.count(INLINE, name, matches=1)
+        return node
+    return counted
+
+def _timedPattern(stats, applyPattern, patterns):
+    def timed(pattern, data, patternIndex):
+        return stats.call(INLINE, patterns.keyOrder[patternIndex],
+                          applyPattern, pattern, data, patternIndex)
+    return timed
@@ -31,47 +31,165 @@ class Treeprocessor(Processor):
         pass
 
 
-class InlineProcessor(Treeprocessor):
+class VisitingTreeprocessor(Treeprocessor):
     """
-    A Treeprocessor that traverses a tree, applying inline patterns.
+    A Treeprocessor that works on one element at a time, so that it can
+    share a single walk over the tree with other VisitingTreeprocessors.
+
+    Markdown runs adjacent VisitingTreeprocessors together.  The ``start``
+    method of each is called with the root, then each element below the
+    root is passed to ``visit`` along with its parent, and finally ``end``
+    is called with the root.  The walk goes through the parents found by
+    ``root.getiterator()`` once ``start`` is done, visiting the children of
+    each in order.  Every processor visits an element before the walk moves
+    on to the next one.
+
+    Set ``tags`` to a sequence of tag names to only visit those elements.
+
+    A processor may change the element it visits or replace it in its
+    parent.  Changes made in ``end`` are not seen by the other processors
+    in the walk.  ``run`` is only used when a processor is run on its own.
+
     """
 
-    def __init__ (self, md):
-        self.__placeholder_prefix = markdown.INLINE_PLACEHOLDER_PREFIX
-        self.__placeholder_suffix = markdown.ETX
-        self.__placeholder_length = 4 + len(self.__placeholder_prefix) \
-                                      + len(self.__placeholder_suffix)
-        self.__placeholder_re = re.compile(markdown.INLINE_PLACEHOLDER % r'([0-9]{4})')
-        self.markdown = md
+    tags = None
 
-    def __makePlaceholder(self, type):
-        """ Generate a placeholder """
-        id = "%04d" % len(self.stashed_nodes)
-        hash = markdown.INLINE_PLACEHOLDER % id
-        return hash, id
+    def start(self, root):
+        """ Prepare for a walk over the tree under root. """
+        pass
 
-    def __findPlaceholder(self, data, index):
-        """
-        Extract id from data string, start from index
+    def visit(self, element, parent):
+        """ Process an element of the tree. """
+        pass
 
-        Keyword arguments:
+    def end(self, root):
+        """ Finish up after the walk. """
+        pass
+
+    def run(self, root):
+        walkTree(root, [self])
+
+
+def walkTree(root, processors):
+    """ Run a list of VisitingTreeprocessors over a tree in one walk. """
+    for processor in processors:
+        processor.start(root)
+    visitors = {}
+    for parent in root.getiterator():
+        for child in parent:
+            tag = child.tag
+            try:
+                callbacks = visitors[tag]
+            except KeyError:
+                callbacks = visitors[tag] = [p.visit for p in processors
+                                             if p.tags is None or tag in p.tags]
+            for callback in callbacks:
+                callback(child, parent)
+    for processor in processors:
+        processor.end(root)
+
+
+_BRACKET_RE = re.compile(r'[][()]')
+
+class _OpenBrackets:
+    """
+    Track the brackets and parentheses a nested pattern, such as a link,
+    leaves open while it is applied to a text.
 
-        * data: string
-        * index: index, from which we start search
+    Once an inner match is replaced by a placeholder, a match that encloses
+    it has to start at one of the brackets still open before the inner
+    match, or at the bracketed text just before an open one, as in
+    "[text](url [inner](x))".  If none is open, nothing before the
+    placeholder can match any more, and the search just goes on after it.
 
-        Returns: placeholder id and string index, after the found placeholder.
+    """
+
+    def __init__(self):
+        self.rejected = []
+        self.rebase(0)
+
+    def rebase(self, offset):
+        """ Start over on a text that is the old one from offset on. """
+        self.scanned = 0
+        self.brackets = []
+        self.parens = []
+        self.rejected = [(s - offset, e - offset)
+                         for s, e in self.rejected
+                         if s >= offset]
+
+    def skip(self, position):
+        """ Go on after a replacement that left no bracket open. """
+        self.scanned = position
+        self.rejected = []
+
+    def reject(self, start, end):
+        """ Note a match the pattern did not accept. """
+        self.rejected.append((start, end))
+
+    def resumePoint(self, data, position):
         """
+        Return where to search again after a match at position, or None
+        if no match can enclose it.
 
-        m = self.__placeholder_re.search(data, index)
-        if m:
-            return m.group(1), m.end()
-        else:
-            return None, index + 1
+        """
+        for m in _BRACKET_RE.finditer(data, self.scanned, position):
+            char = m.group()
+            if char == '[':
+                self.brackets.append(m.start())
+            elif char == '(':
+                self.parens.append(m.start())
+            elif char == ']':
+                if self.brackets:
+                    self.brackets.pop()
+            elif self.parens:
+                self.parens.pop()
+        self.scanned = position
+        if not self.brackets and not self.parens:
+            return None
+        resume = min(self.brackets[:1] + self.parens[:1])
+        # An open "(" or "[" may follow the closed bracketed text of a
+        # link or reference.
+        i = resume - 1
+        while i >= 0 and data[i].isspace():
+            i -= 1
+        if i >= 0 and data[i] == ']':
+            depth = 0
+            while i >= 0:
+                if data[i] == ']':
+                    depth += 1
+                elif data[i] == '[':
+                    depth -= 1
+                    if not depth:
+                        resume = i
+                        break
+                i -= 1
+        if resume and data[resume - 1] == '!':
+            resume -= 1
+        # Searching from the start would find a rejected match again and
+        # go on after it.
+        for start, end in self.rejected:
+            if start < resume < end:
+                resume = start
+        return resume
+
+
+class InlineProcessor(Treeprocessor):
+    """
+    A Treeprocessor that traverses a tree, applying inline patterns.
+    """
+
+    def __init__ (self, md):
+        self.__placeholder_re = re.compile(markdown.INLINE_PLACEHOLDER % r'([0-9]+)')
+        self.markdown = md
 
     def __stashNode(self, node, type):
-        """ Add node to stash """
-        placeholder, id = self.__makePlaceholder(type)
-        self.stashed_nodes[id] = node
+        """
+        Add node to stash and return its placeholder.  Placeholders hold
+        the node's index in the stash, padded to four digits.
+
+        """
+        placeholder = markdown.INLINE_PLACEHOLDER % ("%04d" % len(self.stashed_nodes))
+        self.stashed_nodes.append(node)
         return placeholder
 
     def __handleInline(self, data, patternIndex=0):
@@ -88,15 +206,45 @@ class InlineProcessor(Treeprocessor):
 
         """
         if not isinstance(data, markdown.AtomicString):
-            startIndex = 0
-            while patternIndex < len(self.markdown.inlinePatterns):
-                data, matched, startIndex = self.__applyPattern(
-                    self.markdown.inlinePatterns.value_for_index(patternIndex),
-                    data, patternIndex, startIndex)
-                if not matched:
-                    patternIndex += 1
+            patterns = self.markdown.inlinePatterns.values()
+            while patternIndex < len(patterns):
+                pattern = patterns[patternIndex]
+                triggers = getattr(pattern, 'triggers', None)
+                if triggers is None or self.__isTriggered(data, triggers):
+                    data = self.applyPattern(pattern, data, patternIndex)
+                patternIndex += 1
         return data
 
+    def applyPattern(self, pattern, data, patternIndex):
+        """
+        Apply one inline pattern to a string, replacing its matches with
+        placeholders.
+
+        Keyword arguments:
+
+        * pattern: The inline pattern to apply
+        * data: A line of Markdown text
+        * patternIndex: The index of the pattern in the inlinePatterns
+
+        Returns: String with placeholders.
+
+        """
+        if self.__searchable(pattern):
+            return self.__applyPattern(pattern, data, patternIndex)
+        return self.__applyLegacyPattern(pattern, data, patternIndex)
+
+    def __searchable(self, pattern):
+        """ Check if a pattern can be applied with getSearchRegExp(). """
+        search = getattr(pattern, 'getSearchRegExp', None)
+        return search is not None and search() is not None
+
+    def __isTriggered(self, data, triggers):
+        """ Check if data contains any of a pattern's trigger substrings. """
+        for trigger in triggers:
+            if trigger in data:
+                return True
+        return False
+
     def __processElementText(self, node, subnode, isText=True):
         """
         Process placeholders in Element.text or Element.tail
@@ -108,7 +256,8 @@ class InlineProcessor(Treeprocessor):
         * subnode: processing node
         * isText: bool variable, True - it's text, False - it's tail
 
-        Returns: None
+        Returns: The elements that replace subnode in node if it's the tail
+        of a child, or None if they were added to the front of node.
 
         """
         if isText:
@@ -121,14 +270,58 @@ class InlineProcessor(Treeprocessor):
         childResult = self.__processPlaceholders(text, subnode)
 
         if not isText and node is not subnode:
-            pos = node.getchildren().index(subnode)
-            node.remove(subnode)
-        else:
-            pos = 0
+            return childResult
+
+        node[0:0] = childResult
+        return None
+
+    def __processNode(self, node):
+        """
+        Process placeholders in the text and tails of an Element popped
+        from self.stashed_nodes, and of its children.  A child whose tail
+        holds placeholders is replaced by the elements they stand for.
 
-        childResult.reverse()
-        for newChild in childResult:
-            node.insert(pos, newChild)
+        """
+        children = node.getchildren()
+        if node.tail and node.tail.strip():
+            self.__processElementText(node, node, False)
+        if node.text and node.text.strip():
+            self.__processElementText(node, node)
+
+        # Rebuild the list of children once rather than replacing them
+        # one at a time.
+        newChildren = node[:len(node) - len(children)]
+        replaced = False
+        for child in children:
+            if child.tail and child.tail.strip():
+                newChildren.extend(self.__processElementText(node, child,
+                                                             False))
+                replaced = True
+            else:
+                newChildren.append(child)
+            if child.text and child.text.strip():
+                self.__processElementText(child, child)
+        if replaced:
+            node[:] = newChildren
+
+    def __linkText(self, parent, result, text):
+        """
+        Join pieces of text and append them to the tail of the last element
+        in result, or to the text of parent if there are no elements yet.
+
+        """
+        text = "".join(text)
+        if text:
+            if result:
+                if result[-1].tail:
+                    result[-1].tail += text
+                else:
+                    result[-1].tail = text
+            else:
+                if parent.text:
+                    parent.text += text
+                else:
+                    parent.text = text
 
     def __processPlaceholders(self, data, parent):
         """
@@ -141,103 +334,145 @@ class InlineProcessor(Treeprocessor):
 
         Returns: list with ElementTree elements with applied inline patterns.
         """
-        def linkText(text):
-            if text:
-                if result:
-                    if result[-1].tail:
-                        result[-1].tail += text
-                    else:
-                        result[-1].tail = text
-                else:
-                    if parent.text:
-                        parent.text += text
-                    else:
-                        parent.text = text
-
         result = []
-        strartIndex = 0
-        while data:
-            index = data.find(self.__placeholder_prefix, strartIndex)
-            if index != -1:
-                id, phEndIndex = self.__findPlaceholder(data, index)
-
-                if id in self.stashed_nodes:
-                    node = self.stashed_nodes.get(id)
-
-                    if index > 0:
-                        text = data[strartIndex:index]
-                        linkText(text)
-
-                    if not isString(node): # it's Element
-                        for child in [node] + node.getchildren():
-                            if child.tail:
-                                if child.tail.strip():
-                                    self.__processElementText(node, child, False)
-                            if child.text:
-                                if child.text.strip():
-                                    self.__processElementText(child, child)
-                    else: # it's just a string
-                        linkText(node)
-                        strartIndex = phEndIndex
-                        continue
-
-                    strartIndex = phEndIndex
-                    result.append(node)
-
-                else: # wrong placeholder
-                    end = index + len(prefix)
-                    linkText(data[strartIndex:end])
-                    strartIndex = end
+        text = []
+        startIndex = 0
+        for m in self.__placeholder_re.finditer(data):
+            index = int(m.group(1))
+            if index >= len(self.stashed_nodes): # wrong placeholder
+                continue
+            node = self.stashed_nodes[index]
+            text.append(data[startIndex:m.start()])
+            startIndex = m.end()
+            if isString(node):
+                text.append(node)
             else:
-                text = data[strartIndex:]
-                linkText(text)
-                data = ""
-
+                self.__linkText(parent, result, text)
+                text = []
+                self.__processNode(node)
+                result.append(node)
+        text.append(data[startIndex:])
+        self.__linkText(parent, result, text)
         return result
 
-    def __applyPattern(self, pattern, data, patternIndex, startIndex=0):
+    def __applyPattern(self, pattern, data, patternIndex):
         """
-        Check if the line fits the pattern, create the necessary
-        elements, add it to stashed_nodes.
+        Find every match of the pattern in the line, create the necessary
+        elements and add them to stashed_nodes.
+
+        The text is searched once, left to right, resuming after each
+        match, and the result is assembled from pieces at the end.  If
+        pattern.rescan is set the search starts over after each match, as
+        the match may have made room for another one around it.
 
         Keyword arguments:
 
         * data: the text to be processed
         * pattern: the pattern to be checked
         * patternIndex: index of current pattern
-        * startIndex: string index, from which we starting search
 
         Returns: String with placeholders instead of ElementTree elements.
 
         """
-        match = pattern.getCompiledRegExp().match(data[startIndex:])
-        leftData = data[:startIndex]
+        regexp = pattern.getSearchRegExp()
+        rescan = getattr(pattern, 'rescan', True)
+        if rescan and getattr(pattern, 'nested', False):
+            brackets = _OpenBrackets()
+        else:
+            brackets = None
+        result = []
+        start = 0
+        index = 0
+        end = len(data)
+        while True:
+            match = regexp.search(data, index, end)
+            if match is None:
+                break
+            node = pattern.handleMatch(match)
+            if node is not None:
+                self.__handleNode(node, patternIndex)
+                placeholder = self.__stashNode(node, pattern.type())
+                # The "(.*?)$" that closes getCompiledRegExp() stops short
+                # of a final newline, so each replacement has always dropped
+                # one from the end of the line.  Keep doing that.
+                if match.end() < end and data[end - 1] == "\n":
+                    end -= 1
+                if brackets is not None:
+                    resume = brackets.resumePoint(data, match.start())
+                    if resume is not None:
+                        # Search again from the first place a match could
+                        # start that encloses the placeholder.  The text
+                        # before it is final.
+                        resume = max(resume, start)
+                        result.append(data[start:resume])
+                        data = "%s%s%s" % (data[resume:match.start()],
+                                           placeholder, data[match.end():end])
+                        brackets.rebase(resume)
+                        start = index = 0
+                        end = len(data)
+                        continue
+                    brackets.skip(match.end())
+                result.append(data[start:match.start()])
+                result.append(placeholder)
+                start = match.end()
+                if rescan and brackets is None:
+                    result.append(data[start:end])
+                    data = "".join(result)
+                    result = []
+                    start = index = 0
+                    end = len(data)
+                    continue
+            elif brackets is not None:
+                brackets.reject(match.start(), match.end())
+            index = match.end()
+            if index == match.start():
+                index += 1 # don't find an empty match again
+        if not result:
+            return data
+        result.append(data[start:end])
+        return "".join(result)
+
+    def __applyLegacyPattern(self, pattern, data, patternIndex):
+        """
+        Apply a pattern that provides getCompiledRegExp() only, matching
+        its expression against the whole line until it no longer matches.
 
-        if not match:
-            return data, False, 0
+        Returns: String with placeholders instead of ElementTree elements.
 
-        node = pattern.handleMatch(match)
+        """
+        startIndex = 0
+        while True:
+            match = pattern.getCompiledRegExp().match(data[startIndex:])
+            if not match:
+                return data
+            leftData = data[:startIndex]
+            node = pattern.handleMatch(match)
+            if node is None:
+                startIndex = len(leftData) + match.span(len(match.groups()))[0]
+                continue
+            self.__handleNode(node, patternIndex)
+            placeholder = self.__stashNode(node, pattern.type())
+            data = "%s%s%s%s" % (leftData, match.group(1),
+                                 placeholder, match.groups()[-1])
+            startIndex = 0
 
-        if node is None:
-            return data, True, len(leftData) + match.span(len(match.groups()))[0]
+    def __handleNode(self, node, patternIndex):
+        """
+        Apply inline patterns to the text of a node returned by a pattern.
+        Its text gets the patterns after the current one and its tail gets
+        the current one onwards.
 
+        """
         if not isString(node):
             if not isinstance(node.text, markdown.AtomicString):
                 # We need to process current node too
                 for child in [node] + node.getchildren():
-                    if not isString(node):
-                        if child.text:
-                            child.text = self.__handleInline(child.text,
-                                                            patternIndex + 1)
-                        if child.tail:
-                            child.tail = self.__handleInline(child.tail,
-                                                            patternIndex)
-
-        placeholder = self.__stashNode(node, pattern.type())
-
-        return "%s%s%s%s" % (leftData,
-                             match.group(1),
-                             placeholder, match.groups()[-1]), True, 0
+                    if child.text:
+                        child.text = self.__handleInline(child.text,
+                                                        patternIndex + 1)
+                    if child.tail:
+                        child.tail = self.__handleInline(child.tail,
+                                                        patternIndex)
 
     def run(self, tree):
         """Apply inline patterns to a parsed Markdown tree.
@@ -256,7 +491,7 @@ class InlineProcessor(Treeprocessor):
         Returns: ElementTree object with applied inline patterns.
 
         """
-        self.stashed_nodes = {}
+        self.stashed_nodes = []
 
         stack = [tree]
 
@@ -280,7 +515,6 @@ class InlineProcessor(Treeprocessor):
                     element.text = \
                         markdown.inlinepatterns.handleAttributes(element.text, 
                                                                  element)
-                i = 0
                 for newChild in lst:
                     # Processing attributes
                     if newChild.tail:
@@ -291,39 +525,57 @@ class InlineProcessor(Treeprocessor):
                         newChild.text = \
                             markdown.inlinepatterns.handleAttributes(newChild.text,
                                                                      newChild)
-                    element.insert(i, newChild)
-                    i += 1
+                element[0:0] = lst
         return tree
 
 
-class PrettifyTreeprocessor(Treeprocessor):
+class _PrettifyTags:
+    """ The tags PrettifyTreeprocessor visits: block-level ones and br. """
+
+    def __contains__(self, tag):
+        return tag == 'br' or \
+               (isString(tag) and markdown.isBlockLevel(tag) is not None)
+
+
+class PrettifyTreeprocessor(VisitingTreeprocessor):
     """ Add linebreaks to the html document. """
 
-    def _prettifyETree(self, elem):
-        """ Recursively add linebreaks to ElementTree children. """
+    tags = _PrettifyTags()
 
+    def _prettifyElement(self, elem):
+        """
+        Add linebreaks to an element.  Return True if its block-level
+        children should get linebreaks too.
+
+        """
         i = "\n"
+        expand = False
         if markdown.isBlockLevel(elem.tag) and elem.tag not in ['code', 'pre']:
             if (not elem.text or not elem.text.strip()) \
                     and len(elem) and markdown.isBlockLevel(elem[0].tag):
                 elem.text = i
-            for e in elem:
-                if markdown.isBlockLevel(e.tag):
-                    self._prettifyETree(e)
-            if not elem.tail or not elem.tail.strip():
-                elem.tail = i
+            expand = True
         if not elem.tail or not elem.tail.strip():
             elem.tail = i
+        return expand
 
-    def run(self, root):
+    def start(self, root):
         """ Add linebreaks to ElementTree root object. """
-
-        self._prettifyETree(root)
+        self.expanded = set()
+        if self._prettifyElement(root):
+            self.expanded.add(root)
+
+    def visit(self, elem, parent):
+        if parent in self.expanded and elem.tag != 'br':
+            if self._prettifyElement(elem):
+                self.expanded.add(elem)
         # Do <br />'s seperately as they are often in the middle of
-        # inline content and missed by _prettifyETree.
-        brs = root.getiterator('br')
-        for br in brs:
-            if not br.tail or not br.tail.strip():
-                br.tail = '\n'
+        # inline content and missed by the block-level elements.
+        if elem.tag == 'br':
+            if not elem.tail or not elem.tail.strip():
+                elem.tail = '\n'
             else:
-                br.tail = '\n%s' % br.tail
+                elem.tail = '\n%s' % elem.tail
+
+    def end(self, root):
+        self.expanded = None